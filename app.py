@@ -24,19 +24,24 @@ import os
 import operator
 import math
 import re
+import time
 import json
 import uuid
+import hmac
 import pandas as pd
 import numpy as np
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from flask.ext.sqlalchemy import SQLAlchemy
-from flask.ext.uuid import FlaskUUID
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
+from flask_sqlalchemy import SQLAlchemy
+from flask_uuid import FlaskUUID
 from collections import Counter
+from datetime import datetime, timedelta
 from sqlalchemy import desc
-from sklearn.manifold import TSNE
+from sqlalchemy.exc import IntegrityError
 
-from lib.make_grid import make_grid
+from lib import acquisition, early_stopping, export, instrumentation, profiling
+from lib.make_grid import make_lazy_grid
+from lib.model_cache import MODEL_CACHE
 from lib.choosers import *
 from lib.utils import *
 
@@ -46,14 +51,44 @@ FlaskUUID(app)
 app.config.from_object(os.getenv('APP_SETTINGS') or 'config.DevelopmentConfig')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
 db = SQLAlchemy(app)
+MODEL_CACHE.max_bytes = app.config['MODEL_CACHE_MAX_BYTES']
+acquisition.configure(app.config['ACQUISITION_WORKERS'])
 
 from models import *
+from projections import METRICS, get_projection, project_points
+from suggestions import num_results, queued_points, rank_points, schedule_refresh
+
+# a batch of reports is recorded again this many times when it clashes with a concurrent one
+REPORT_ATTEMPTS = 3
+
+
+@app.before_request
+def start_timing():
+    instrumentation.start(request.endpoint)
+
+
+@app.after_request
+def finish_timing(response):
+    seconds, timings = instrumentation.finish()
+    # echo where the time went in JSON responses, for whoever asks
+    if request.headers.get('X-Loop-Timings') and response.mimetype == 'application/json' \
+            and not response.is_streamed:
+        body = json.loads(response.get_data(as_text=True))
+        if isinstance(body, dict):
+            body['timings'] = dict(timings, total=seconds)
+            response.set_data(json.dumps(body))
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/', methods=['GET'])
 def index():
     try:
-        modelgrids = db.session.query(ModelGrid).order_by(desc(ModelGrid.updated_at)).limit(10)
+        modelgrids = db.session.query(ModelGrid).order_by(desc(ModelGrid.updated_at)).limit(10).all()
     except:
         return jsonify(exception="Cannot connect to the database.")
     return render_template('index.html', modelgrids=modelgrids)
@@ -68,40 +103,70 @@ def default_model_view(id):
 def view_model(id, path):
     try:
         modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
-        grid = modelgrid.get_grid()
-        complete = grid.loc[grid._loop_status == "complete", :]
-        complete = complete.sort_values(by="_loop_value", ascending=modelgrid.minimize)
-        pending = grid.loc[grid._loop_status == "pending", :]
-        columns = [x for x in list(grid.columns.values) if not x.startswith("_loop")]
+        columns = modelgrid.get_grid().columns
     except:
         return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
     try:
+        # the pages only render a shell, the data is fetched from the JSON routes
         return render_template('model_{}.html'.format(path),
                                modelgrid=modelgrid,
-                               grid=grid,
-                               complete=complete,
-                               pending=pending,
                                columns=columns)
     except:
         return render_template('404.html', model_id=str(id)), 404
 
 
+@app.route("/trials/<uuid:id>", methods=['GET'])
+def view_trials(id):
+    try:
+        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        columns = modelgrid.get_grid().columns
+    except:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
+    status = request.args.get('status') or "complete"
+    if status not in ["complete", "pending", "stopped"]:
+        return jsonify(exception="Unknown status <{}>".format(status))
+    sort = request.args.get('sort') or ("_loop_value" if status == "complete" else "_loop_id")
+    if sort not in columns + LazyGrid.LOOP_COLUMNS:
+        return jsonify(exception="Unknown column <{}> to sort by".format(sort))
+    order = request.args.get('order')
+    if order not in [None, "asc", "desc"]:
+        return jsonify(exception="Unknown order <{}>, use asc or desc".format(order))
+    if order is None:
+        # best values first
+        order = "desc" if sort == "_loop_value" and not modelgrid.minimize else "asc"
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', app.config['TABLE_PAGE_SIZE'], type=int)
+    if offset < 0 or not 0 < limit <= app.config['MAX_GRID_PAGE_SIZE']:
+        error_string = "The <offset> must not be negative and the <limit> must be between 1 and {}."
+        return jsonify(exception=error_string.format(app.config['MAX_GRID_PAGE_SIZE']))
+    filters = {x: request.args.get(x) for x in columns if request.args.get(x) is not None}
+    try:
+        trials, total = modelgrid.page_trials(status, sort, order == "desc", filters, offset, limit)
+    except ValueError:
+        return jsonify(exception="Numeric parameters can only be filtered by numbers")
+    return jsonify(trials=json.loads(trials.to_json(orient='records')), total=total, offset=offset, limit=limit)
+
+
 @app.route("/new_model", methods=['POST'])
 def new_model():
     data = request.get_json() or {}
     if not data:
         return jsonify(exception="Invalid data POSTed to /new_model")
     try:
-        grid = make_grid(data)
+        grid = make_lazy_grid(data)
         new_model_id = uuid.uuid4()
         minimize = data.get("minimize") or False
         chooser = data.get("chooser") or DEFAULT_CHOOSER
         name = data.get("name") or "An experiment has no name"
-        if chooser not in list(LIST_OF_CHOOSERS.keys()):
+        if chooser not in LIST_OF_CHOOSERS:
             error_string = """The chooser <{}> that you've supplied is not yet implemented.
                 You can find the list of available choosers by querying /choosers endpoint."""
             return jsonify(exception=error_string.format(chooser))
-        db.session.add(ModelGrid(new_model_id, grid.to_json(), chooser, name, minimize))
+        try:
+            early_stopping.settings(data.get("early_stopping"))
+        except ValueError as e:
+            return jsonify(exception=str(e))
+        db.session.add(ModelGrid(str(new_model_id), grid.spec, chooser, name, minimize, data.get("early_stopping")))
         db.session.commit()
     except:
         return jsonify(exception="Unable to add item to database.")
@@ -117,31 +182,194 @@ def report_metric(id):
         return jsonify(exception="Must supply a <value> to /report_metric route")
     if "loop_id" not in data:
         return jsonify(exception="Must supply a <loop_id> to /report_metric route")
+    modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+    if modelgrid is None:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
     try:
-        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
-        candidates = modelgrid.get_grid()
+        error_string = _commit_metrics(modelgrid, [data])[0]
+    except IntegrityError:
+        return jsonify(exception="Unable to record the metric, it kept clashing with concurrent reports.")
+    if error_string:
+        return jsonify(exception=error_string)
+    schedule_refresh(modelgrid)
+    return jsonify(status="ok")
 
-        if not candidates.loc[candidates._loop_id == data.get('loop_id'), :].shape[0]:
-            error_string = "No set of parameters corresponding to your id of {} found."
-            return jsonify(exception=error_string.format(data.get('loop_id')))
-        if not math.isnan(candidates.loc[candidates._loop_id == data.get('loop_id'), "_loop_value"]):
-            error_string = "There is already a score of {} associated with this set of parameters"
-            score = candidates.loc[candidates._loop_id == data.get('loop_id'), "_loop_value"]
-            return jsonify(exception=error_string.format(round(float(score), 2)))
 
-        candidates.loc[candidates._loop_id == data.get('loop_id'), "_loop_value"] = data.get("value")
-        candidates.loc[candidates._loop_id == data.get('loop_id'), "_loop_status"] = "complete"
-        if data.get("duration"):
-            candidates.loc[candidates._loop_id == data.get('loop_id'),
-                           "_loop_duration"] = data.get("duration")
+@app.route("/report_metrics/<uuid:id>", methods=['POST'])
+def report_metrics(id):
+    data = request.get_json()
+    if not data or not isinstance(data, list):
+        return jsonify(exception="Must POST a non-empty array of metrics to /report_metrics")
+    if len(data) > app.config['MAX_REPORT_BATCH_SIZE']:
+        error_string = "Can not report more than {} metrics at once."
+        return jsonify(exception=error_string.format(app.config['MAX_REPORT_BATCH_SIZE']))
+    modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+    if modelgrid is None:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
+    try:
+        errors = _commit_metrics(modelgrid, data)
+    except IntegrityError:
+        return jsonify(exception="Unable to record the metrics, they kept clashing with concurrent reports.")
+    if None in errors:
+        schedule_refresh(modelgrid)
+    results = []
+    for metric, error_string in zip(data, errors):
+        loop_id = metric.get('loop_id') if isinstance(metric, dict) else None
+        if error_string:
+            results.append({'loop_id': loop_id, 'exception': error_string})
+        else:
+            results.append({'loop_id': loop_id, 'status': "ok"})
+    return jsonify(results=results)
 
-        modelgrid.grid = candidates.to_json()
-        # also record a submission
-        db.session.add(Submission(str(id), int(data.get('loop_id')), float(data.get("value"))))
-        db.session.commit()
+
+@app.route("/report_intermediate/<uuid:id>", methods=['POST'])
+def report_intermediate(id):
+    data = request.get_json() or {}
+    if not data:
+        return jsonify(exception="Invalid data POSTed to /report_intermediate")
+    for key in ["loop_id", "step", "value"]:
+        if key not in data:
+            return jsonify(exception="Must supply a <{}> to /report_intermediate route".format(key))
+    try:
+        loop_id, step, value = int(data['loop_id']), int(data['step']), float(data['value'])
+    except (TypeError, ValueError):
+        return jsonify(exception="The <loop_id>, <step> and <value> must be numbers")
+    try:
+        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        settings = early_stopping.settings(modelgrid.early_stopping)
     except:
         return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
-    return jsonify(status="ok")
+    # a concurrent report of the final value must not slip in between
+    trial = db.session.query(Trial).filter_by(model_id=modelgrid.id, loop_id=loop_id).with_for_update().first()
+    if trial is None or trial.status != "pending":
+        db.session.rollback()
+        return jsonify(exception="Only pending points can report intermediate values, {} is not.".format(loop_id))
+
+    rung = early_stopping.rung(step, settings['min_step'], settings['reduction_factor'])
+    reached = IntermediateReport.highest_rung(modelgrid.id, loop_id)
+    if rung is not None and reached is not None and rung <= reached:
+        rung = None
+    db.session.add(IntermediateReport(modelgrid.id, loop_id, step, value, rung))
+    stop = False
+    if rung is not None:
+        db.session.flush()
+        values = IntermediateReport.rung_values(modelgrid.id, rung)
+        stop = early_stopping.should_stop(value, values, settings['reduction_factor'],
+                                          settings['min_trials'], modelgrid.minimize)
+    if stop:
+        # the last value stands in for the result, choosers learn to stay away from the point
+        trial.status = "stopped"
+        trial.value = value
+        modelgrid.record_stopped()
+        modelgrid.touch()
+    db.session.commit()
+    if stop:
+        schedule_refresh(modelgrid)
+    return jsonify(decision="stop" if stop else "continue", rung=rung)
+
+
+@app.route("/curves/<uuid:id>", methods=['GET'])
+def curves(id):
+    try:
+        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        model_id = modelgrid.id
+    except:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
+    loop_ids = request.args.get('loop_ids')
+    try:
+        loop_ids = [int(x) for x in loop_ids.split(',')] if loop_ids else None
+    except ValueError:
+        return jsonify(exception="The <loop_ids> must be a comma separated list of numbers")
+    found = IntermediateReport.curves(model_id, loop_ids)
+    return jsonify(curves={str(k): [list(x) for x in v] for k, v in found.items()})
+
+
+def _commit_metrics(modelgrid, metrics):
+    """Record reported metrics and commit them, returns what `_record_metrics` does.
+
+    Two reports of a point that was never suggested both insert its trial, the one that
+    loses the race is recorded again and then gets an error for that point only.
+    """
+    for attempt in range(REPORT_ATTEMPTS):
+        with instrumentation.phase('record'):
+            errors = _record_metrics(modelgrid, metrics)
+        if None in errors:
+            modelgrid.touch()
+        try:
+            with instrumentation.phase('commit'):
+                db.session.commit()
+            return errors
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == REPORT_ATTEMPTS - 1:
+                raise
+
+
+def _record_metrics(modelgrid, metrics):
+    """Validate reported metrics against the grid and record the valid ones in the session.
+
+    All trials involved are fetched and locked with a single query. Returns an error string for
+    every metric that was rejected and None for every metric that was recorded.
+    """
+    grid = modelgrid.get_grid()
+    loop_ids = set()
+    for metric in metrics:
+        try:
+            loop_id = int(metric['loop_id'])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            continue
+        # ids off the grid are turned down below, they may not even fit in the column
+        if 0 <= loop_id < grid.size:
+            loop_ids.add(loop_id)
+    trials = {}
+    if loop_ids:
+        query = db.session.query(Trial).filter(Trial.model_id == modelgrid.id, Trial.loop_id.in_(loop_ids))
+        # concurrent reports of the same point wait for each other, in loop id order to not deadlock
+        trials = {x.loop_id: x for x in query.order_by(Trial.loop_id).with_for_update()}
+
+    errors, results = [], []
+    for metric in metrics:
+        if not isinstance(metric, dict):
+            errors.append("Every metric must be an object with a <loop_id> and a <value>")
+            continue
+        if "value" not in metric:
+            errors.append("Must supply a <value>")
+            continue
+        if "loop_id" not in metric:
+            errors.append("Must supply a <loop_id>")
+            continue
+        try:
+            loop_id = int(metric.get('loop_id'))
+            value = float(metric.get("value"))
+            duration = float(metric.get("duration")) if metric.get("duration") else None
+        except (TypeError, ValueError, OverflowError):
+            errors.append("The <loop_id>, <value> and <duration> of a metric must be numbers")
+            continue
+
+        trial = trials.get(loop_id)
+        if trial is None:
+            if not 0 <= loop_id < grid.size:
+                error_string = "No set of parameters corresponding to your id of {} found."
+                errors.append(error_string.format(metric.get('loop_id')))
+                continue
+            # a point that has never been suggested, it only exists on the lazy grid so far
+            trial = trials[loop_id] = Trial(modelgrid.id, loop_id, grid.params(loop_id), "complete")
+            db.session.add(trial)
+        if trial.value is not None:
+            error_string = "There is already a score of {} associated with this set of parameters"
+            errors.append(error_string.format(round(float(trial.value), 2)))
+            continue
+
+        results.append((loop_id, value, duration, trial.status == "pending"))
+        trial.value = value
+        trial.status = "complete"
+        if duration:
+            trial.duration = duration
+        # also record a submission
+        db.session.add(Submission(modelgrid.id, loop_id, value))
+        errors.append(None)
+    modelgrid.record_results(results)
+    return errors
 
 
 @app.route("/choosers", methods=['GET', 'POST'])
@@ -149,41 +377,192 @@ def choosers():
     return jsonify(choosers=list(LIST_OF_CHOOSERS.keys()), default=DEFAULT_CHOOSER)
 
 
+@app.route("/cache_stats", methods=['GET'])
+def cache_stats():
+    return jsonify(**MODEL_CACHE.stats())
+
+
 @app.route("/new_iteration/<uuid:id>", methods=['GET', 'POST'])
 def new_point(id):
+    batch_size = request.args.get('n', type=int)
+    if batch_size is not None and not 0 < batch_size <= app.config['MAX_BATCH_SIZE']:
+        error_string = "Number of points <n> must be between 1 and {}."
+        return jsonify(exception=error_string.format(app.config['MAX_BATCH_SIZE']))
+    lease = request.args.get('lease', app.config['LEASE_SECONDS'], type=int)
+    if not 0 < lease <= app.config['MAX_LEASE_SECONDS']:
+        error_string = "The <lease> must be between 1 and {} seconds."
+        return jsonify(exception=error_string.format(app.config['MAX_LEASE_SECONDS']))
+    profile = bool(request.args.get('profile'))
+    if profile and not _is_admin():
+        return jsonify(exception="Only admins can profile the chooser.")
     try:
-        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
-        full_grid = modelgrid.get_grid()
-        candidates, pending, complete = slice_df(full_grid)
-        values = complete["_loop_value"] * (-1)**(modelgrid.minimize + 1)
-        if not candidates.shape[0]:
+        with instrumentation.phase('load'):
+            modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+            grid = modelgrid.get_grid()
+            # points of workers that went away are handed out again, and not fantasized about
+            modelgrid.reclaim_expired()
+            db.session.commit()
+            trials = modelgrid.get_trials()
+        instrumentation.label(chooser=modelgrid.chooser)
+        num_complete = num_results(trials)
+        if not grid.size - trials.shape[0]:
             return jsonify(exception="There are no more candidates left in the grid.")
     except:
         return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
 
-    acquisition_function = LIST_OF_CHOOSERS[modelgrid.chooser]
-    # if we don't have any data to model with - use random search
-    if complete.shape[0] < (app.config['RANDOM_SEARCH_THRESHOLD'] or 2):
-        acquisition_function = LIST_OF_CHOOSERS["random"]
-    relevant_columns = [x for x in full_grid.columns.values.tolist() if not x.startswith("_loop")]
-    selected_row, new_grid = acquisition_function(full_grid,
-                                                  candidates[relevant_columns],
-                                                  pending[relevant_columns],
-                                                  complete[relevant_columns],
-                                                  values)
-
-    selected_row = int(candidates.iloc[selected_row]["_loop_id"])
-    new_grid.loc[new_grid._loop_id == selected_row, "_loop_status"] = "pending"
-    params = new_grid.loc[new_grid._loop_id == selected_row, :].to_dict(orient='records')[0]
-    params = {k: v for k, v in params.items() if not k.startswith('_loop')}
+    started = time.time()
+    # single points come off the queue the background thread keeps ranked, if it is up to date
+    with instrumentation.phase('queue'):
+        ranked = queued_points(modelgrid, num_complete) if batch_size is None and not profile else []
+    state, timing, extra = None, {'fit': None, 'queued': True}, {}
+    if not ranked:
+        # the model is fit outside of any transaction, only claiming the chosen points is atomic
+        rank = profiling.profiled if profile else _call
+        (ranked, state, timing), report = rank(rank_points, modelgrid, grid, trials,
+                                               n=batch_size or app.config['CLAIM_CANDIDATES'],
+                                               batch=batch_size is not None)
+        timing['queued'] = False
+        if profile:
+            num_pending = int((trials["_loop_status"] == "pending").sum())
+            extra['profile_id'] = _save_profile(modelgrid, num_complete, num_pending, report)
+        if timing['fit'] is not None:
+            schedule_refresh(modelgrid)
 
     try:
-        modelgrid.grid = new_grid.to_json()
-        db.session.commit()
+        with instrumentation.phase('claim'):
+            lease_expires_at = datetime.utcnow() + timedelta(seconds=lease)
+            selected_rows = _claim(modelgrid, grid, ranked, batch_size or 1, state, lease_expires_at)
     except:
         error_string = "Unable to update the model grid in the database for an unknown reason."
         return jsonify(exception=error_string)
-    return jsonify(params=params, loop_id=selected_row)
+    if not selected_rows:
+        return jsonify(exception="There are no more candidates left in the grid.")
+    timing['total_seconds'] = time.time() - started
+    extra['lease_expires_at'] = lease_expires_at.isoformat()
+    if batch_size is None:
+        return jsonify(params=grid.params(selected_rows[0]), loop_id=selected_rows[0], timing=timing, **extra)
+    return jsonify(points=[{'params': grid.params(x), 'loop_id': x} for x in selected_rows], timing=timing, **extra)
+
+
+@app.route("/heartbeat/<uuid:id>", methods=['POST'])
+def heartbeat(id):
+    data = request.get_json() or {}
+    loop_ids = data.get("loop_ids") if isinstance(data, dict) else None
+    if not loop_ids or not isinstance(loop_ids, list):
+        return jsonify(exception="Must supply a non-empty list of <loop_ids> to /heartbeat route")
+    try:
+        loop_ids = [int(x) for x in loop_ids]
+        lease = int(data.get("lease") or app.config['LEASE_SECONDS'])
+    except (TypeError, ValueError):
+        return jsonify(exception="The <loop_ids> and the <lease> must be numbers")
+    if not 0 < lease <= app.config['MAX_LEASE_SECONDS']:
+        error_string = "The <lease> must be between 1 and {} seconds."
+        return jsonify(exception=error_string.format(app.config['MAX_LEASE_SECONDS']))
+    try:
+        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        lease_expires_at = datetime.utcnow() + timedelta(seconds=lease)
+        lost = modelgrid.renew_leases(loop_ids, lease_expires_at)
+        db.session.commit()
+    except:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
+    return jsonify(lease_expires_at=lease_expires_at.isoformat(), lost=lost)
+
+
+def _call(func, *args, **kwargs):
+    return func(*args, **kwargs), None
+
+
+def _is_admin():
+    token = app.config['ADMIN_TOKEN']
+    given = request.headers.get('X-Loop-Admin-Token') or ''
+    return bool(token) and hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8'))
+
+
+def _save_profile(modelgrid, num_complete, num_pending, report):
+    profile = Profile(modelgrid.id, modelgrid.chooser, num_complete, num_pending, report)
+    db.session.add(profile)
+    db.session.flush()
+    # only the latest few are kept
+    stale = db.session.query(Profile.id).filter(Profile.model_id == modelgrid.id) \
+        .order_by(desc(Profile.created_at), desc(Profile.id)).offset(app.config['PROFILES_KEPT'])
+    db.session.query(Profile).filter(Profile.id.in_([x.id for x in stale])).delete(synchronize_session=False)
+    db.session.commit()
+    return profile.id
+
+
+@app.route("/profiles/<uuid:id>", methods=['GET'])
+def view_profiles(id):
+    if not _is_admin():
+        return jsonify(exception="Only admins can see profiles.")
+    profiles = db.session.query(Profile).filter(Profile.model_id == str(id)) \
+        .order_by(desc(Profile.created_at), desc(Profile.id)).all()
+    return jsonify(profiles=[x.to_dict() for x in profiles])
+
+
+@app.route("/profiles/<uuid:id>/<int:profile_id>.prof", methods=['GET'])
+def download_profile(id, profile_id):
+    if not _is_admin():
+        return jsonify(exception="Only admins can see profiles.")
+    profile = db.session.query(Profile).filter_by(model_id=str(id), id=profile_id).first()
+    if profile is None:
+        return jsonify(exception="Unable to find profile {} of model {}.".format(profile_id, id))
+    return Response(profile.data, mimetype='application/octet-stream')
+
+
+def _claim(modelgrid, grid, ranked, n=1, chooser_state=None, lease_expires_at=None):
+    """Mark the first `n` points of `ranked` that nobody has claimed yet as pending.
+
+    The unique index on trials (model_id, loop_id) makes claiming atomic: when several
+    workers insert the same point only one of them commits, the others drop the points
+    that were taken from their list and retry, topping it up with any free points once
+    their list runs out. Any other integrity error is raised. All points are claimed in
+    one transaction, which also saves `chooser_state` when given. The points are
+    reclaimed after `lease_expires_at` unless their worker heartbeats.
+    """
+    model_id = modelgrid.id
+    ranked = [int(x) for x in ranked]
+    claim = ranked[:n]
+    while claim:
+        try:
+            db.session.add_all([Trial(model_id, x, grid.params(x), "pending", lease_expires_at) for x in claim])
+            modelgrid.record_pending(len(claim))
+            if chooser_state is not None and chooser_state != modelgrid.chooser_state:
+                modelgrid.chooser_state = chooser_state
+            modelgrid.touch()
+            db.session.commit()
+            return claim
+        except IntegrityError:
+            db.session.rollback()
+            touched = modelgrid.touched_ids()
+            if touched.isdisjoint(claim):
+                # nobody took any of the points, something else is wrong and retrying will not help
+                raise
+        ranked = [x for x in ranked if x not in touched]
+        claim = ranked[:n]
+        if len(claim) < n:
+            claim += grid.sample(n - len(claim), list(touched) + claim).tolist()
+    return claim
+
+
+@app.route("/release/<uuid:id>", methods=['POST'])
+def release(id):
+    data = request.get_json() or {}
+    loop_ids = data.get("loop_ids") if isinstance(data, dict) else None
+    if not loop_ids or not isinstance(loop_ids, list):
+        return jsonify(exception="Must supply a non-empty list of <loop_ids> to /release route")
+    try:
+        loop_ids = [int(x) for x in loop_ids]
+    except (TypeError, ValueError):
+        return jsonify(exception="The <loop_ids> must be numbers")
+    try:
+        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        released = modelgrid.release(loop_ids)
+        if released:
+            modelgrid.touch()
+        db.session.commit()
+    except:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
+    return jsonify(released=released)
 
 
 @app.route("/grid/<uuid:id>", methods=['GET'])
@@ -191,20 +570,69 @@ def view_grid(id):
     ALLOWED_SUBSET_TYPES = [
         "complete",
         "pending",
+        "stopped",
         "candidate"
     ]
     try:
         modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        all_columns = modelgrid.get_grid().columns + LazyGrid.LOOP_COLUMNS
     except:
         return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
-    grid = modelgrid.get_grid()
     subset = request.args.get('subset')
-    if subset:
-        if subset in ALLOWED_SUBSET_TYPES:
-            grid = grid.loc[grid._loop_status == subset, :]
-        else:
-            return jsonify(exception="Unknown subset type <{}>".format(subset))
-    return jsonify(grid=grid.to_json(), minimize=modelgrid.minimize)
+    if subset and subset not in ALLOWED_SUBSET_TYPES:
+        return jsonify(exception="Unknown subset type <{}>".format(subset))
+    fmt = request.args.get('format') or 'json'
+    if fmt not in export.FORMATS:
+        return jsonify(exception="Unknown format <{}>, use one of {}".format(fmt, export.FORMATS))
+    if fmt in export.BINARY_FORMATS and export.pyarrow is None:
+        return jsonify(exception="The <{}> format needs pyarrow to be installed.".format(fmt))
+    columns = request.args.get('columns')
+    columns = columns.split(',') if columns else all_columns
+    unknown = [x for x in columns if x not in all_columns]
+    if unknown:
+        return jsonify(exception="Unknown columns {}".format(unknown))
+    after = request.args.get('after', -1, type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 0 < limit <= app.config['MAX_GRID_PAGE_SIZE']:
+        error_string = "The <limit> must be between 1 and {}."
+        return jsonify(exception=error_string.format(app.config['MAX_GRID_PAGE_SIZE']))
+
+    pages = (page[columns] for page in modelgrid.iter_grid(subset, start=after + 1))
+    if limit is None and fmt in ['ndjson', 'csv', 'arrow']:
+        # stream every page as soon as it is ready, however large the grid
+        return Response(stream_with_context(export.serialize(pages, fmt, columns)), mimetype=export.MIMETYPES[fmt])
+    if limit is None and subset not in ["complete", "pending", "stopped"] \
+            and modelgrid.grid_size > app.config['MAX_MATERIALIZED_GRID_SIZE']:
+        error_string = "The grid of {} points is too large to be returned at once, page through it instead."
+        return jsonify(exception=error_string.format(modelgrid.grid_size))
+
+    grid = _take(pages, limit, pd.DataFrame(columns=columns))
+    # the loop id to pass as <after> for the next page, if there may be one
+    cursor = int(grid.index[-1]) if limit is not None and grid.shape[0] == limit else None
+    if fmt == 'json' and limit is None:
+        return jsonify(grid=grid.to_json(), minimize=modelgrid.minimize)
+    if fmt == 'json':
+        return jsonify(grid=grid.to_json(), minimize=modelgrid.minimize, next=cursor)
+    response = Response(b''.join(_as_bytes(x) for x in export.serialize([grid], fmt, columns)),
+                        mimetype=export.MIMETYPES[fmt])
+    if cursor is not None:
+        response.headers['X-Next-Cursor'] = str(cursor)
+    return response
+
+
+def _take(pages, limit, empty):
+    frames, num_rows = [], 0
+    for page in pages:
+        if limit is not None and num_rows + page.shape[0] >= limit:
+            frames.append(page.iloc[:limit - num_rows])
+            break
+        frames.append(page)
+        num_rows += page.shape[0]
+    return pd.concat(frames) if frames else empty
+
+
+def _as_bytes(chunk):
+    return chunk.encode('utf-8') if isinstance(chunk, str) else chunk
 
 
 @app.route("/last_values/<uuid:id>", methods=['GET'])
@@ -213,76 +641,132 @@ def last_values(id):
         modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
     except:
         return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
-    values = [x.value for x in modelgrid.submissions]
-    return jsonify(values=values[-20:])
+    if modelgrid is None:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
+    values = Submission.recent_values([modelgrid.id], app.config['LAST_VALUES'])
+    return jsonify(values=values[modelgrid.id])
+
+
+@app.route("/last_values", methods=['GET'])
+def batch_last_values():
+    model_ids = [x for x in request.args.get('ids', '').split(',') if x]
+    n = request.args.get('n', app.config['LAST_VALUES'], type=int)
+    if not 0 < n <= app.config['MAX_LAST_VALUES']:
+        return jsonify(exception="<n> must be between 1 and {}.".format(app.config['MAX_LAST_VALUES']))
+    if len(model_ids) > app.config['MAX_LAST_VALUES_MODELS']:
+        error_string = "Values can be listed for at most {} models at once."
+        return jsonify(exception=error_string.format(app.config['MAX_LAST_VALUES_MODELS']))
+    return jsonify(values=Submission.recent_values(model_ids, n))
+
+
+@app.route("/partial_dependency_data/<uuid:id>", methods=['GET'])
+def all_partial_dependency_data(id):
+    try:
+        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        data = _partial_dependency(modelgrid)
+    except:
+        return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
+    return jsonify(data=data)
 
 
 @app.route("/partial_dependency_data/<uuid:id>/<column>", methods=['GET'])
 def partial_dependency_data(id, column):
     try:
-        grid = db.session.query(ModelGrid).filter_by(id=str(id)).first().get_grid()
+        modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
+        data = _partial_dependency(modelgrid)
     except:
         return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
-    aggregate = grid.loc[grid._loop_status == "complete", :]
-    aggregate = aggregate.groupby(column)
-    aggregate = aggregate.groups
-    aggregate = {str(k): grid.loc[v, '_loop_value'].values.tolist() for k, v in aggregate.items()}
-    return jsonify(data=aggregate)
+    if column not in data:
+        return jsonify(exception="There is no parameter <{}> in the grid.".format(column))
+    return jsonify(data={str(x['value']): x['values'] for x in data[column]})
+
+
+def _partial_dependency(modelgrid):
+    """Aggregate the completed results by the value of every parameter, in the order of the grid's values.
+
+    Only the parameters and values of completed trials are read, with a single query.
+    """
+    grid = modelgrid.get_grid()
+    query = db.session.query(Trial.params, Trial.value).filter(Trial.model_id == modelgrid.id,
+                                                                Trial.status == "complete")
+    groups = dict((column, {}) for column in grid.columns)
+    for params, value in query:
+        for column in grid.columns:
+            groups[column].setdefault(json.dumps(params.get(column)), []).append(value)
+    data = {}
+    for variable in grid.spec:
+        levels = []
+        for level in variable.get("values"):
+            values = groups[variable.get("name")].get(json.dumps(level))
+            if values:
+                levels.append({'value': level,
+                               'count': len(values),
+                               'mean': sum(values) / len(values),
+                               'min': min(values),
+                               'max': max(values),
+                               'values': values})
+        data[variable.get("name")] = levels
+    return data
 
 
 @app.route("/tsne_data/<uuid:id>/", methods=['GET'])
 def tsne_data(id):
     NUM_CATEGORIES = 5
+    metric = request.args.get('metric') if request.args.get('metric') else 'euclidean'
+    if metric not in METRICS:
+        return jsonify(exception="Unknown metric <{}>, use one of {}".format(metric, list(METRICS)))
     try:
         modelgrid = db.session.query(ModelGrid).filter_by(id=str(id)).first()
-        grid = modelgrid.get_grid().sort_values(by="_loop_id")
+        grid = modelgrid.get_grid()
+        projection = get_projection(modelgrid, metric)
     except:
         return jsonify(exception="Unable to find a model with uuid {} in the database.".format(id))
-    columns = [x for x in list(grid.columns.values) if not x.startswith("_loop")]
-    coords = grid.loc[:, columns]
-    metric = request.args.get('metric') if request.args.get('metric') else 'mahalanobis'
-    model = TSNE(random_state=0, n_iter_without_progress=30, metric=metric)
-    try:
-        projection = model.fit_transform(coords)
-    except ValueError as err:
-        return jsonify(exception="Unable to fit TSNE for model with uuid {} because: {}".format(id, err))
+    if projection.status == "computing":
+        return jsonify(status="computing")
+    if projection.status == "failed":
+        return jsonify(exception="Unable to fit TSNE for model with uuid {} because: {}".format(id, projection.error))
+    # the projection is fixed, only the coloring follows the results
+    trials = modelgrid.get_trials()
+    loop_ids, projection = project_points(projection, grid, trials.index)
+    projection = pd.DataFrame(projection, index=loop_ids)
+    values = trials._loop_value.reindex(loop_ids)
+    coords = grid.to_frame(loop_ids)[grid.columns]
     # subdivide into array of arrays based on _loop_value
-    classes = grid.groupby(pd.cut(grid._loop_value, NUM_CATEGORIES)).groups
-    missing = grid.loc[grid._loop_value.isnull()].index.tolist()
+    classes = values.groupby(pd.cut(values, NUM_CATEGORIES)).groups if values.notnull().any() else {}
+    missing = values.loc[values.isnull()].index.tolist()
     # find best point for the chart
-    submissions = modelgrid.submissions
-    values = [x.value for x in submissions]
-    which_best = np.argmin(values) if modelgrid.minimize else np.argmax(values)
-    which_best = [x.loop_id for x in submissions][which_best]
+    complete = trials._loop_value.dropna()
+    which_best = None
+    if complete.shape[0]:
+        which_best = int(complete.idxmin() if modelgrid.minimize else complete.idxmax())
     # split and highlight points
     points = {}
     which_missing = [int(x) for x in missing]
     points['unsampled'] = {
-        'coordinates': projection[which_missing].tolist(),
+        'coordinates': projection.loc[which_missing].values.tolist(),
         'tooltip': coords.loc[which_missing].to_json(),
         'loop_id': which_missing,
         'value': ['NaN' for x in which_missing]
     }
 
+    best_point = False
     for k in classes.keys():
         which = [int(x) for x in classes[k]]
+        if not which:
+            continue
         if which_best in which:
             best_point = {
-                'coordinates': projection[which_best].tolist(),
+                'coordinates': projection.loc[which_best].values.tolist(),
                 'tooltip': coords.loc[which_best].to_json(),
                 'loop_id': which_best,
-                'value': grid.loc[which_best]._loop_value
+                'value': values.loc[which_best]
             }
-        else:
-            best_point = False
-        coordinates = projection[which].tolist()
-        tooltip = coords.loc[which].to_json()
-        points[k] = {
-            'coordinates': coordinates,
-            'tooltip': tooltip,
+        points[str(k)] = {
+            'coordinates': projection.loc[which].values.tolist(),
+            'tooltip': coords.loc[which].to_json(),
             'loop_id': which,
-            'value': list(grid.loc[which]._loop_value.values),
-            'best_point': best_point
+            'value': values.loc[which].values.tolist(),
+            'best_point': best_point if which_best in which else False
         }
     return jsonify(projection=points, best_point=best_point)
 
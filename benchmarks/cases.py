@@ -0,0 +1,122 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+
+def grid_payload(size, dims, chooser=None):
+    """A /new_model payload of `dims` float parameters, with about `size` points in all."""
+    levels = max(2, int(math.ceil(size ** (1.0 / dims))))
+    payload = {'name': 'benchmark', 'minimize': True,
+               'params': [{'name': 'x{}'.format(i), 'type': 'float', 'min': 0, 'max': 1, 'num_points': levels}
+                          for i in range(dims)]}
+    if chooser:
+        payload['chooser'] = chooser
+    return payload
+
+
+def objective(params):
+    """A smooth function with a single minimum, standing in for a model's loss."""
+    return sum((value - 0.3) ** 2 + 0.1 * math.sin(10 * value) for value in params.values())
+
+
+def make_grid_case(size, dims, seed):
+    from lib.make_grid import make_grid, make_lazy_grid
+
+    payload = grid_payload(size, dims)
+    results = []
+    started = time.time()
+    grid = make_lazy_grid(payload)
+    results.append(('make_lazy_grid', time.time() - started, len(json.dumps(grid.spec))))
+    started = time.time()
+    frame = grid.to_frame()
+    results.append(('to_frame', time.time() - started, int(frame.memory_usage(deep=True).sum())))
+    del frame
+    started = time.time()
+    frame = make_grid(payload)
+    results.append(('make_grid', time.time() - started, int(frame.memory_usage(deep=True).sum())))
+    return {'grid_size': grid.size}, results
+
+
+def chooser_case(chooser, size, completed, dims, seed):
+    from config import Config
+    from lib.choosers import LIST_OF_CHOOSERS
+    from lib.make_grid import make_lazy_grid
+
+    grid = make_lazy_grid(grid_payload(size, dims))
+    random_state = np.random.RandomState(seed)
+    loop_ids = random_state.choice(grid.size, min(completed, grid.size), replace=False)
+    complete = grid.to_frame(loop_ids)[grid.columns]
+    # choosers minimize what they are given, like the objective
+    values = complete.apply(lambda x: objective(x.to_dict()), axis=1)
+    pending = complete.iloc[:0]
+    started = time.time()
+    ranked = LIST_OF_CHOOSERS[chooser](grid, pending, complete, values, n=1, max_candidates=Config.MAX_CANDIDATES)
+    return {'grid_size': grid.size}, [('next', time.time() - started, len(json.dumps([int(x) for x in ranked])))]
+
+
+def http_case(size, completed, dims, seed, database_url, chooser):
+    os.environ['APP_SETTINGS'] = 'config.TestingConfig'
+    os.environ['TEST_DATABASE_URL'] = database_url
+    from app import app, db
+    from lib.make_grid import make_lazy_grid
+
+    client = app.test_client()
+    results = []
+
+    def timed(name, method, url, data=None):
+        started = time.time()
+        response = getattr(client, method)(url, data=None if data is None else json.dumps(data),
+                                           content_type='application/json')
+        results.append((name, time.time() - started, len(response.data)))
+        return response
+
+    payload = grid_payload(size, dims, chooser)
+    grid = make_lazy_grid(payload)
+    random_state = np.random.RandomState(seed)
+    loop_ids = random_state.choice(grid.size, min(completed, grid.size), replace=False)
+    batch_size = app.config['MAX_REPORT_BATCH_SIZE']
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        model_id = json.loads(timed('new_model', 'post', '/new_model', payload).data.decode())['id']
+        for start in range(0, len(loop_ids), batch_size):
+            metrics = [{'loop_id': int(x), 'value': objective(grid.params(x)), 'duration': 1.0}
+                       for x in loop_ids[start:start + batch_size]]
+            timed('report_metrics', 'post', '/report_metrics/{}'.format(model_id), metrics)
+        timed('new_iteration', 'get', '/new_iteration/{}'.format(model_id))
+        timed('grid_complete', 'get', '/grid/{}?subset=complete'.format(model_id))
+        timed('grid_page', 'get', '/grid/{}?limit=10000'.format(model_id))
+        timed('grid_ndjson', 'get', '/grid/{}?format=ndjson'.format(model_id))
+        timed('trials', 'get', '/trials/{}'.format(model_id))
+        timed('partial_dependency', 'get', '/partial_dependency_data/{}'.format(model_id))
+        timed('last_values', 'get', '/last_values?ids={}'.format(model_id))
+        timed('index', 'get', '/')
+        db.session.remove()
+        db.drop_all()
+    return {'grid_size': grid.size}, results
@@ -0,0 +1,181 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+"""Benchmarks of grid construction, the choosers and the HTTP routes.
+
+    $ python -m benchmarks.run --output results.json
+    $ python -m benchmarks.run --baseline results.json --output new.json
+
+Every case runs in a process of its own, so that its peak memory is its own.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import traceback
+
+from benchmarks import cases
+
+SUITES = ['make_grid', 'choosers', 'http']
+CHOOSERS = ['random', 'random_forest_regressor', 'gp_regressor']
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_COMPLETED = [10, 100, 1000]
+METRICS = ['seconds', 'peak_rss_bytes', 'payload_bytes']
+
+
+def plan(args):
+    """Every (suite, name, function, arguments) to run."""
+    for size in args.sizes:
+        if 'make_grid' in args.suites:
+            yield 'make_grid', {'size': size, 'dims': args.dims}, cases.make_grid_case, (size, args.dims, args.seed)
+        for completed in args.completed:
+            if 'choosers' in args.suites:
+                for chooser in args.choosers:
+                    params = {'chooser': chooser, 'size': size, 'completed': completed, 'dims': args.dims}
+                    yield 'choosers', params, cases.chooser_case, (chooser, size, completed, args.dims, args.seed)
+            if 'http' in args.suites:
+                params = {'chooser': args.http_chooser, 'size': size, 'completed': completed, 'dims': args.dims}
+                yield 'http', params, cases.http_case, (size, completed, args.dims, args.seed,
+                                                        args.database_url, args.http_chooser)
+
+
+def run_case(function, arguments, repeat):
+    """Run a case `repeat` times in fresh processes, keeping the fastest time of every step."""
+    steps, errors = {}, []
+    for _ in range(repeat):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_child, args=(queue, function, arguments))
+        process.start()
+        outcome = queue.get()
+        process.join()
+        if 'error' in outcome:
+            errors.append(outcome['error'])
+            continue
+        for name, seconds, payload_bytes in outcome['results']:
+            step = steps.setdefault(name, {'seconds': seconds, 'peak_rss_bytes': outcome['peak_rss_bytes'],
+                                           'payload_bytes': payload_bytes, 'runs': []})
+            step['runs'].append(seconds)
+            step['seconds'] = min(step['seconds'], seconds)
+        steps.setdefault('_info', {}).update(outcome['info'])
+    return steps, errors
+
+
+def _child(queue, function, arguments):
+    try:
+        info, results = function(*arguments)
+        queue.put({'info': info, 'results': results, 'peak_rss_bytes': _peak_rss()})
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+
+
+def _peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def compare(results, baseline, tolerance):
+    """Every metric of `results` that is more than `tolerance` worse than the same one in `baseline`."""
+    previous = {_key(x): x for x in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        for metric in METRICS:
+            if result.get(metric) and before.get(metric) and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append({'suite': result['suite'], 'step': result['step'], 'params': result['params'],
+                                    'metric': metric, 'baseline': before[metric], 'value': result[metric]})
+    return regressions
+
+
+def _key(result):
+    return result['suite'], result['step'], json.dumps(result['params'], sort_keys=True)
+
+
+def _parse_ints(value):
+    return [int(float(x)) for x in value.split(',') if x]
+
+
+def _parse_list(value):
+    return [x for x in value.split(',') if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', type=_parse_list, default=SUITES, help="comma separated, of " + ", ".join(SUITES))
+    parser.add_argument('--sizes', type=_parse_ints, default=DEFAULT_SIZES, help="grid sizes, like 1e3,1e6")
+    parser.add_argument('--completed', type=_parse_ints, default=DEFAULT_COMPLETED, help="completed trials")
+    parser.add_argument('--dims', type=int, default=3, help="number of parameters of the grids")
+    parser.add_argument('--choosers', type=_parse_list, default=CHOOSERS)
+    parser.add_argument('--http-chooser', default='gp_regressor', help="chooser of the models the routes serve")
+    parser.add_argument('--database-url', default=os.getenv('BENCHMARK_DATABASE_URL'),
+                        help="the HTTP suite runs against a throwaway SQLite file by default, "
+                             "all tables of this database are dropped")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--baseline', help="JSON file of earlier results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="regressions are worse than this fraction")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        args.database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+
+    results = {'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seed': args.seed,
+                        'database': args.database_url.split(':')[0] if 'http' in args.suites else None},
+               'results': [], 'errors': []}
+    for suite, params, function, arguments in plan(args):
+        steps, errors = run_case(function, arguments, args.repeat)
+        params.update(steps.pop('_info', {}))
+        for name, step in steps.items():
+            results['results'].append(dict(step, suite=suite, step=name, params=params))
+            print("{:<10} {:<20} {:<70} {:>10.4f}s {:>14} bytes".format(
+                suite, name, json.dumps(params, sort_keys=True), step['seconds'], step['payload_bytes']))
+        for error in errors:
+            results['errors'].append({'suite': suite, 'params': params, 'error': error})
+            print("{:<10} {:<20} {:<70} failed\n{}".format(suite, '', json.dumps(params, sort_keys=True), error))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("regression: {suite} {step} {params} {metric} {baseline} -> {value}".format(**regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
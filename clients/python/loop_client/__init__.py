@@ -0,0 +1,36 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+"""A client for Loop, the hyperparameter optimization service.
+
+    with LoopClient('http://localhost:5000') as loop:
+        loop.new_model(params, minimize=True)
+        for _ in range(100):
+            point = loop.next()
+            loop.report(point['loop_id'], train(**point['params']))
+"""
+
+from loop_client.client import LoopClient, LoopError
+from loop_client.aio import AsyncLoopClient
+
+__all__ = ['LoopClient', 'AsyncLoopClient', 'LoopError']
@@ -0,0 +1,83 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import asyncio
+import functools
+
+from loop_client.client import LoopClient
+
+
+class AsyncLoopClient(object):
+    """A LoopClient for trainers that run on an asyncio event loop.
+
+    Requests are made on the executor of the event loop, so they never block it.
+    Reports are buffered the same way, queueing one does not wait for the server.
+
+        async with AsyncLoopClient('http://localhost:5000', experiment_id) as loop:
+            point = await loop.next()
+            loop.report(point['loop_id'], await train(**point['params']))
+    """
+
+    def __init__(self, url, experiment_id=None, executor=None, **kwargs):
+        self.client = LoopClient(url, experiment_id, **kwargs)
+        self.executor = executor
+
+    @property
+    def experiment_id(self):
+        return self.client.experiment_id
+
+    async def new_model(self, params, chooser=None, name=None, minimize=False, early_stopping=None):
+        return await self._run(self.client.new_model, params, chooser, name, minimize, early_stopping)
+
+    async def next(self):
+        return await self._run(self.client.next)
+
+    async def next_batch(self, n):
+        return await self._run(self.client.next_batch, n)
+
+    def report(self, loop_id, value, duration=None):
+        self.client.report(loop_id, value, duration)
+
+    def release(self, loop_id):
+        self.client.release(loop_id)
+
+    async def give_back(self, loop_id):
+        await self._run(self.client.give_back, loop_id)
+
+    async def report_intermediate(self, loop_id, step, value):
+        return await self._run(self.client.report_intermediate, loop_id, step, value)
+
+    async def flush(self):
+        await self._run(self.client.flush)
+
+    async def close(self):
+        await self._run(self.client.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _run(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args))
@@ -0,0 +1,271 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import logging
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (502, 503, 504)
+ALREADY_REPORTED = "There is already a score"
+
+
+class LoopError(Exception):
+    """The server turned a request down, or could not be reached."""
+
+
+class LoopClient(object):
+    """Talks to one Loop experiment over a pooled keep-alive session.
+
+    Reports are buffered and sent in bulk by a background thread, at most every
+    `flush_interval` seconds or as soon as `batch_size` of them are waiting. With `prefetch`
+    the next point is claimed while the caller works on the current one. Claimed points
+    stay pending on the server until they are reported, another thread heartbeats them
+    every `heartbeat_interval` seconds so that the server does not hand them out again.
+    A point prefetched but never used is given back on `close`.
+    """
+
+    def __init__(self, url, experiment_id=None, timeout=30, retries=5, backoff=0.5,
+                 flush_interval=1.0, batch_size=100, prefetch=True, heartbeat_interval=60.0, session=None):
+        self.url = url.rstrip('/')
+        self.experiment_id = experiment_id and str(experiment_id)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.heartbeat_interval = heartbeat_interval
+        self.session = session or requests.Session()
+        self._buffer = []
+        self._errors = []
+        self._in_flight = False
+        self._flush_now = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._flusher = None
+        self._held = set()
+        self._heartbeat = None
+        self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        self._prefetched = None
+
+    def new_model(self, params, chooser=None, name=None, minimize=False, early_stopping=None):
+        """Start a new experiment, this client talks to it from now on. Returns its id."""
+        payload = {'params': params, 'minimize': minimize}
+        if chooser:
+            payload['chooser'] = chooser
+        if name:
+            payload['name'] = name
+        if early_stopping:
+            payload['early_stopping'] = early_stopping
+        self.experiment_id = self._request('post', '/new_model', payload)['id']
+        return self.experiment_id
+
+    def minimizes(self):
+        """Whether the experiment minimizes its metric."""
+        return self._request('get', '/grid/{}?subset=complete&limit=1'.format(self.experiment_id))['minimize']
+
+    def next(self):
+        """The next point to try, a dict with a `loop_id` and `params`."""
+        prefetched, self._prefetched = self._prefetched, None
+        point = prefetched.result() if prefetched is not None else self._next()
+        if self.prefetch:
+            self._prefetched = self._prefetcher.submit(self._next)
+        return point
+
+    def next_batch(self, n):
+        """`n` points to try at once."""
+        points = self._request('get', '/new_iteration/{}?n={}'.format(self.experiment_id, n))['points']
+        self._hold([x['loop_id'] for x in points])
+        return points
+
+    def report(self, loop_id, value, duration=None):
+        """Queue the result of a point, to be sent with others in the background."""
+        metric = {'loop_id': int(loop_id), 'value': float(value)}
+        if duration is not None:
+            metric['duration'] = float(duration)
+        with self._condition:
+            if self._closed:
+                raise LoopError("The client is closed")
+            self._held.discard(metric['loop_id'])
+            self._buffer.append(metric)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_in_background, name='loop-client-flusher')
+                self._flusher.daemon = True
+                self._flusher.start()
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+
+    def report_intermediate(self, loop_id, step, value):
+        """Report the value of a point part of the way through. Returns True if it should be stopped.
+
+        Sent right away, a stopped point needs no final result.
+        """
+        payload = {'loop_id': int(loop_id), 'step': int(step), 'value': float(value)}
+        response = self._request('post', '/report_intermediate/{}'.format(self.experiment_id), payload)
+        if response['decision'] == 'stop':
+            self.release(loop_id)
+            return True
+        return False
+
+    def release(self, loop_id):
+        """Stop heartbeating a point that will not be reported, it is handed out again once its lease runs out."""
+        with self._condition:
+            self._held.discard(int(loop_id))
+
+    def give_back(self, loop_id):
+        """Hand a point that will not be tried back to the server, which can suggest it again right away."""
+        self.release(loop_id)
+        self._request('post', '/release/{}'.format(self.experiment_id), {'loop_ids': [int(loop_id)]})
+
+    def flush(self):
+        """Send every queued result now. Raises a LoopError for any that were turned down so far."""
+        with self._condition:
+            self._flush_now = True
+            self._condition.notify_all()
+            while self._buffer or self._in_flight:
+                self._condition.wait()
+            errors, self._errors = self._errors, []
+        if errors:
+            raise LoopError("Unable to report {} results: {}".format(len(errors), errors))
+
+    def close(self):
+        """Send the queued results, give back a prefetched point and stop the background threads."""
+        try:
+            self.flush()
+        finally:
+            prefetched, self._prefetched = self._prefetched, None
+            if prefetched is not None and not prefetched.cancel():
+                try:
+                    self.give_back(prefetched.result()['loop_id'])
+                except LoopError as e:
+                    logger.warning("Unable to give back the prefetched point: %s", e)
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            if self._flusher is not None:
+                self._flusher.join()
+            if self._heartbeat is not None:
+                self._heartbeat.join()
+            self._prefetcher.shutdown()
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next(self):
+        response = self._request('get', '/new_iteration/{}'.format(self.experiment_id))
+        self._hold([response['loop_id']])
+        return {'loop_id': response['loop_id'], 'params': response['params']}
+
+    def _hold(self, loop_ids):
+        with self._condition:
+            self._held.update(loop_ids)
+            if self._heartbeat is None and self.heartbeat_interval:
+                self._heartbeat = threading.Thread(target=self._heartbeat_in_background, name='loop-client-heartbeat')
+                self._heartbeat.daemon = True
+                self._heartbeat.start()
+
+    def _heartbeat_in_background(self):
+        while True:
+            with self._condition:
+                deadline = time.time() + self.heartbeat_interval
+                while not self._closed and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                if self._closed:
+                    return
+                held = sorted(self._held)
+            if not held:
+                continue
+            try:
+                lost = self._request('post', '/heartbeat/{}'.format(self.experiment_id), {'loop_ids': held})['lost']
+            except LoopError as e:
+                logger.warning("Unable to heartbeat %s points: %s", len(held), e)
+                continue
+            if lost:
+                logger.warning("Points %s are not pending anymore, their leases may have run out", lost)
+                with self._condition:
+                    self._held.difference_update(lost)
+
+    def _flush_in_background(self):
+        while True:
+            with self._condition:
+                deadline = time.time() + self.flush_interval
+                while not (self._closed or self._flush_now or len(self._buffer) >= self.batch_size):
+                    if time.time() >= deadline:
+                        break
+                    self._condition.wait(deadline - time.time())
+                if not self._buffer:
+                    self._flush_now = False
+                    if self._closed:
+                        return
+                    continue
+                batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+                self._in_flight = True
+            try:
+                body, resent = self._send('post', '/report_metrics/{}'.format(self.experiment_id), batch)
+                errors = [x for x in body['results'] if 'exception' in x]
+                if resent:
+                    # an earlier attempt may have been recorded before its response got lost
+                    errors = [x for x in errors if not x['exception'].startswith(ALREADY_REPORTED)]
+            except LoopError as e:
+                errors = [{'loop_id': x['loop_id'], 'exception': str(e)} for x in batch]
+            for error in errors:
+                logger.warning("Unable to report the result of point %s: %s", error['loop_id'], error['exception'])
+            with self._condition:
+                self._errors.extend(errors)
+                self._in_flight = False
+                self._condition.notify_all()
+
+    def _request(self, method, path, payload=None):
+        """Send a request, retrying with exponential backoff when the server can not be reached."""
+        return self._send(method, path, payload)[0]
+
+    def _send(self, method, path, payload=None):
+        """Like `_request`, also returns whether the request had to be sent more than once."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, self.url + path, json=payload, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    body = response.json()
+                    if isinstance(body, dict) and 'exception' in body:
+                        raise LoopError(body['exception'])
+                    return body, attempt > 0
+                error = "{} {}".format(response.status_code, response.reason)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except (requests.RequestException, ValueError) as e:
+                raise LoopError(str(e))
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+        raise LoopError("Unable to reach {} after {} attempts: {}".format(self.url, self.retries + 1, error))
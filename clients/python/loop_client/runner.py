@@ -0,0 +1,241 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+"""Drive an objective function over a pool of worker processes.
+
+    $ python -m loop_client.runner --url http://localhost:5000 --objective train:evaluate \
+        --payload params.json --workers 8 --budget 200 --patience 50
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+
+from loop_client.client import LoopClient, LoopError
+
+logger = logging.getLogger(__name__)
+
+# a point whose worker died this many times is given up on
+MAX_ATTEMPTS = 2
+# what the server says once every point of the grid was handed out
+NO_MORE_CANDIDATES = "There are no more candidates left in the grid."
+
+
+def run(objective, payload=None, url='http://localhost:5000', experiment_id=None, workers=None,
+        budget=None, patience=None, tolerance=0.0, **client_options):
+    """Evaluate `objective(**params)` on the points Loop suggests, `workers` at a time.
+
+    A new experiment is created from the make_grid `payload` unless `experiment_id` is
+    given. Points claimed by a worker that dies are handed to a new worker, points given up
+    on are left for the server to hand out again once their lease runs out. Stops after
+    `budget` successful evaluations, failed ones are made up for, after `patience` results
+    in a row that did not beat the best one by more than `tolerance`, or once the grid is
+    exhausted. Returns a summary of the run.
+    """
+    workers = workers or os.cpu_count() or 1
+    client = LoopClient(url, experiment_id, prefetch=False, **client_options)
+    if experiment_id is None:
+        minimize = bool(payload.get('minimize'))
+        client.new_model(payload['params'], payload.get('chooser'), payload.get('name'), minimize,
+                         payload.get('early_stopping'))
+    else:
+        minimize = client.minimizes()
+    pool = _Pool(objective, workers)
+    summary = {'experiment_id': client.experiment_id, 'evaluated': 0, 'failed': 0,
+               'best_value': None, 'best_loop_id': None, 'best_params': None}
+    since_best, exhausted = 0, False
+    try:
+        while True:
+            stopping = exhausted or (budget is not None and summary['evaluated'] >= budget) or \
+                (patience is not None and since_best >= patience)
+            for worker in pool.idle() if not stopping else []:
+                if budget is not None and summary['evaluated'] + len(pool.busy()) >= budget:
+                    break
+                try:
+                    point = client.next()
+                except LoopError as e:
+                    if str(e) != NO_MORE_CANDIDATES:
+                        raise
+                    logger.info("No more points to evaluate")
+                    exhausted = True
+                    break
+                pool.assign(worker, point)
+            if stopping and not pool.busy():
+                break
+            for point, value, error, seconds in pool.results(timeout=0.5):
+                if error is not None:
+                    summary['failed'] += 1
+                    logger.warning("Evaluating point %s failed: %s", point['loop_id'], error)
+                    client.release(point['loop_id'])
+                    continue
+                client.report(point['loop_id'], value, seconds)
+                summary['evaluated'] += 1
+                best = summary['best_value']
+                if best is None or (best - value if minimize else value - best) > tolerance:
+                    since_best = 0
+                else:
+                    since_best += 1
+                if best is None or (value < best if minimize else value > best):
+                    summary.update(best_value=value, best_loop_id=point['loop_id'], best_params=point['params'])
+            for point in pool.replace_dead():
+                summary['failed'] += 1
+                client.release(point['loop_id'])
+    finally:
+        pool.close()
+        try:
+            client.close()
+        except LoopError as e:
+            logger.warning("%s", e)
+    return summary
+
+
+class _Pool(object):
+    """Worker processes that evaluate one point at a time, replaced when they die."""
+
+    def __init__(self, objective, size):
+        self.objective = objective
+        self.outbox = multiprocessing.Queue()
+        self.workers = [self._start() for _ in range(size)]
+
+    def _start(self):
+        inbox = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_work, args=(self.objective, inbox, self.outbox))
+        process.daemon = True
+        process.start()
+        return {'process': process, 'inbox': inbox, 'point': None, 'attempts': 0}
+
+    def idle(self):
+        return [x for x in self.workers if x['point'] is None]
+
+    def busy(self):
+        return [x for x in self.workers if x['point'] is not None]
+
+    def assign(self, worker, point, attempts=1):
+        worker['point'], worker['attempts'] = point, attempts
+        worker['inbox'].put(point)
+
+    def results(self, timeout):
+        """Wait up to `timeout` seconds for results, returns (point, value, error, seconds) tuples."""
+        results = []
+        try:
+            message = self.outbox.get(timeout=timeout)
+            while True:
+                results.extend(self._finish(*message))
+                message = self.outbox.get_nowait()
+        except queue.Empty:
+            return results
+
+    def _finish(self, pid, value, error, seconds):
+        for worker in self.workers:
+            if worker['process'].pid == pid and worker['point'] is not None:
+                point, worker['point'] = worker['point'], None
+                return [(point, value, error, seconds)]
+        # from a worker that died right after, its point was handed to another one already
+        return []
+
+    def replace_dead(self):
+        """Start a new worker for every one that died, retrying its point. Returns the points given up on."""
+        lost = []
+        for i, worker in enumerate(self.workers):
+            if worker['process'].is_alive():
+                continue
+            point = worker['point']
+            logger.warning("A worker died with exit code %s", worker['process'].exitcode)
+            self.workers[i] = self._start()
+            if point is None:
+                continue
+            if worker['attempts'] < MAX_ATTEMPTS:
+                self.assign(self.workers[i], point, worker['attempts'] + 1)
+            else:
+                logger.warning("Giving up on point %s, its workers died %s times", point['loop_id'], MAX_ATTEMPTS)
+                lost.append(point)
+        return lost
+
+    def close(self):
+        for worker in self.workers:
+            worker['inbox'].put(None)
+        for worker in self.workers:
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+
+
+def _work(objective, inbox, outbox):
+    pid = os.getpid()
+    while True:
+        point = inbox.get()
+        if point is None:
+            return
+        started = time.time()
+        try:
+            outbox.put((pid, float(objective(**point['params'])), None, time.time() - started))
+        except Exception:
+            outbox.put((pid, None, traceback.format_exc(), time.time() - started))
+
+
+def load_objective(path):
+    """The function at `path`, given as "module:function"."""
+    module, _, name = path.partition(':')
+    if not name:
+        raise ValueError("The objective must be given as module:function, not {}".format(path))
+    sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module), name)
+
+
+def main(argv=None):
+    """Run an objective from the command line.
+
+    Progress is logged to stderr, the summary of the run is printed to stdout as JSON.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objective', required=True, help="module:function that takes the parameters")
+    parser.add_argument('--payload', help="JSON file with the /new_model payload")
+    parser.add_argument('--experiment-id', help="keep going with an existing experiment instead")
+    parser.add_argument('--url', default=os.getenv('LOOP_URL', 'http://localhost:5000'))
+    parser.add_argument('--workers', type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument('--budget', type=int, default=None, help="number of successful evaluations to stop after")
+    parser.add_argument('--patience', type=int, default=None,
+                        help="stop after this many results in a row that did not improve on the best one")
+    parser.add_argument('--tolerance', type=float, default=0.0, help="smallest improvement that counts")
+    args = parser.parse_args(argv)
+    if bool(args.payload) == bool(args.experiment_id):
+        parser.error("pass either --payload or --experiment-id")
+    payload = None
+    if args.payload:
+        with open(args.payload) as f:
+            payload = json.load(f)
+    logging.basicConfig(level=logging.INFO)
+    summary = run(load_objective(args.objective), payload, args.url, args.experiment_id, args.workers,
+                  args.budget, args.patience, args.tolerance)
+    print(json.dumps(summary, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
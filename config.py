@@ -31,6 +31,29 @@ class Config(object):
     TESTING = False
     CSRF_ENABLED = True
     RANDOM_SEARCH_THRESHOLD = 2
+    MAX_CANDIDATES = 100000  # score a sample of this many points on larger grids
+    CANDIDATE_SAMPLING = 'random'  # or 'halton', the neighbors of the best point are always scored too
+    ACQUISITION_WORKERS = 4  # threads candidates are scored on
+    MAX_MATERIALIZED_GRID_SIZE = 1000000
+    MAX_GRID_PAGE_SIZE = 100000
+    TABLE_PAGE_SIZE = 50
+    LAST_VALUES = 20  # values in the sparklines of the index page
+    MAX_LAST_VALUES = 1000
+    MAX_LAST_VALUES_MODELS = 100
+    CLAIM_CANDIDATES = 16  # runners-up to try when concurrent workers claim the same point
+    MAX_BATCH_SIZE = 100
+    MAX_REPORT_BATCH_SIZE = 10000
+    LEASE_SECONDS = 3600  # a pending point goes back to the candidates unless its worker heartbeats in time
+    MAX_LEASE_SECONDS = 7 * 24 * 3600
+    PRECOMPUTE_SUGGESTIONS = True  # rank the next points in a background thread after results come in
+    SUGGESTION_QUEUE_SIZE = 16
+    SUGGESTION_MAX_AGE = 600  # seconds
+    TSNE_MAX_POINTS = 5000  # larger grids are projected with PCA instead
+    PROJECTION_MAX_POINTS = 20000  # PCA is fit on a sample of this many points and shows them
+    PROJECTION_TIMEOUT = 3600  # seconds after which a projection still computing is started over
+    MODEL_CACHE_MAX_BYTES = 256 * 1024 * 1024  # fitted surrogate models kept between iterations, per process
+    ADMIN_TOKEN = os.getenv('LOOP_ADMIN_TOKEN')  # needed to profile choosers, profiling is off without one
+    PROFILES_KEPT = 10  # per model grid
     SECRET_KEY = 'change me in production'  # changeme
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
 
@@ -53,3 +76,5 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    PRECOMPUTE_SUGGESTIONS = False  # tests refresh the queue themselves
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'loop_test.db')
@@ -0,0 +1,150 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import collections
+import threading
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.lazy_grid import _isin
+
+BLOCK_SIZE = 10000
+SAMPLINGS = ('random', 'halton')
+
+_workers = 1
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(workers):
+    """Set the number of threads candidates are scored on, 1 scores them in the calling thread."""
+    global _workers, _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _workers, _pool = max(1, int(workers)), None
+
+
+def candidate_blocks(grid, exclude=(), max_candidates=None, sampling='random', around=(),
+                     block_size=BLOCK_SIZE, random_state=None):
+    """Yield the loop ids worth scoring, at most `block_size` at a time.
+
+    These are all points not in `exclude` if there are at most `max_candidates` of them.
+    Otherwise they are a sample of that many, drawn uniformly at random or from a Halton
+    sequence, plus the neighbors of the points in `around` (usually the best one so far).
+    """
+    exclude = np.unique(np.asarray(exclude, dtype=np.int64))
+    if max_candidates is None or grid.size - exclude.shape[0] <= max_candidates:
+        for block in grid.candidate_blocks(exclude, block_size=block_size):
+            yield block
+        return
+    if sampling not in SAMPLINGS:
+        raise ValueError("Unknown candidate sampling <{}>, use one of {}".format(sampling, SAMPLINGS))
+    if sampling == 'halton':
+        sample = _halton_sample(grid, max_candidates, exclude, random_state)
+    else:
+        sample = grid.sample(max_candidates, exclude, random_state)
+    neighbors = [grid.neighbors(x) for x in around]
+    neighbors = np.setdiff1d(np.concatenate(neighbors or [[]]).astype(np.int64), exclude)
+    sample = np.concatenate([neighbors, np.setdiff1d(sample, neighbors)])
+    for start in range(0, sample.shape[0], block_size):
+        yield sample[start:start + block_size]
+
+
+def top_k(score, blocks, k):
+    """Score every block of loop ids with `score` and keep the `k` best, highest score first.
+
+    Blocks are scored on the thread pool with only a few of them in flight at a time,
+    so memory stays flat no matter how many candidates there are. Returns the loop ids
+    and their scores.
+    """
+    top_ids, top_scores = np.array([], dtype=np.int64), np.array([])
+    for loop_ids, scores in _imap(score, blocks):
+        top_ids, top_scores = np.concatenate([top_ids, loop_ids]), np.concatenate([top_scores, scores])
+        which = np.argsort(-top_scores, kind='mergesort')[:k]
+        top_ids, top_scores = top_ids[which], top_scores[which]
+    return top_ids, top_scores
+
+
+def _imap(func, iterable):
+    # like Executor.map, but it does not drain `iterable` up front
+    pool = _get_pool()
+    if pool is None:
+        for x in iterable:
+            yield x, func(x)
+        return
+    in_flight = collections.deque()
+    for x in iterable:
+        in_flight.append((x, pool.submit(func, x)))
+        if len(in_flight) >= 2 * _workers:
+            x, future = in_flight.popleft()
+            yield x, future.result()
+    while in_flight:
+        x, future = in_flight.popleft()
+        yield x, future.result()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None and _workers > 1:
+            _pool = ThreadPoolExecutor(max_workers=_workers)
+        return _pool
+
+
+def _halton_sample(grid, n, exclude, random_state=None):
+    """Draw up to `n` distinct loop ids not in `exclude` that cover the grid evenly."""
+    random_state = random_state or np.random
+    start = random_state.randint(0, 2 ** 30)
+    index = np.arange(start, start + 2 * n, dtype=np.int64)
+    loop_ids = np.zeros(index.shape[0], dtype=np.int64)
+    for base, radix, stride in zip(_primes(len(grid.radices)), grid.radices, grid._strides):
+        digit = np.floor(_radical_inverse(index, base) * radix).astype(np.int64)
+        loop_ids += np.minimum(digit, radix - 1) * stride
+    loop_ids = loop_ids[~_isin(loop_ids, exclude)]
+    _, first = np.unique(loop_ids, return_index=True)
+    loop_ids = loop_ids[np.sort(first)][:n]
+    if loop_ids.shape[0] < n:
+        # small or mostly touched grids run out of distinct points, top them up at random
+        topup = grid.sample(n - loop_ids.shape[0], np.concatenate([exclude, loop_ids]), random_state)
+        loop_ids = np.concatenate([loop_ids, topup])
+    return loop_ids
+
+
+def _radical_inverse(index, base):
+    result, scale, index = np.zeros(index.shape[0]), 1.0 / base, index.copy()
+    while np.any(index > 0):
+        result += scale * (index % base)
+        index //= base
+        scale /= base
+    return result
+
+
+def _primes(n):
+    primes, candidate = [], 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
@@ -20,14 +20,113 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
-from . import random_chooser
-from . import random_forest_regressor
-from . import gp_regressor
-
-LIST_OF_CHOOSERS = {
-    'random': random_chooser.next,
-    'random_forest_regressor': random_forest_regressor.next,
-    'gp_regressor': gp_regressor.next
-}
+
+"""Choosers pick the next points to try, given the results so far.
+
+Choosers are registered by the name of the function that implements them and only
+imported the first time they are used, they pull in heavy dependencies like sklearn.
+Packages can add their own through the "loop.choosers" entry point group, e.g.
+
+    entry_points={'loop.choosers': ['my_chooser = my_package.chooser:next']}
+"""
+
+import importlib
+import logging
+import threading
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+__all__ = ['LIST_OF_CHOOSERS', 'DEFAULT_CHOOSER', 'ChooserRegistry']
+
+ENTRY_POINT_GROUP = 'loop.choosers'
+
+logger = logging.getLogger(__name__)
+
+
+class ChooserRegistry(Mapping):
+    """Chooser functions by name, imported on first lookup.
+
+    `discover` returns the entry points of plugin choosers, it is only called the first time
+    a name is missing or the choosers are listed, so that booting a worker stays cheap.
+    """
+
+    def __init__(self, discover=None):
+        self._targets = OrderedDict()
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._discover = discover
+
+    def register(self, name, target):
+        """Register `target`, a chooser function or where to find it as "module:function"."""
+        with self._lock:
+            self._targets[name] = target
+            self._loaded.pop(name, None)
+
+    def __getitem__(self, name):
+        chooser = self._loaded.get(name)
+        if chooser is None:
+            if name not in self._targets:
+                self._register_plugins()
+            with self._lock:
+                chooser = self._loaded[name] = _load(self._targets[name])
+        return chooser
+
+    def __contains__(self, name):
+        if name not in self._targets:
+            self._register_plugins()
+        return name in self._targets
+
+    def __iter__(self):
+        self._register_plugins()
+        return iter(list(self._targets))
+
+    def __len__(self):
+        self._register_plugins()
+        return len(self._targets)
+
+    def _register_plugins(self):
+        if self._discover is None:
+            return
+        with self._lock:
+            if self._discover is None:
+                return
+            discover, self._discover = self._discover, None
+            for entry_point in discover():
+                if entry_point.name in self._targets:
+                    logger.warning("Ignoring the %s chooser of a plugin, it is built in", entry_point.name)
+                    continue
+                self._targets[entry_point.name] = entry_point
+
+
+def _load(target):
+    if callable(target):
+        return target
+    if isinstance(target, str):
+        module, _, name = target.partition(':')
+        return getattr(importlib.import_module(module), name)
+    # an entry point
+    return target.load()
+
+
+def _entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return []
+        return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+    found = entry_points()
+    if hasattr(found, 'select'):
+        return list(found.select(group=ENTRY_POINT_GROUP))
+    return list(found.get(ENTRY_POINT_GROUP, []))
+
+
+LIST_OF_CHOOSERS = ChooserRegistry(discover=_entry_points)
+LIST_OF_CHOOSERS.register('random', 'lib.choosers.random_chooser:next')
+LIST_OF_CHOOSERS.register('random_forest_regressor', 'lib.choosers.random_forest_regressor:next')
+LIST_OF_CHOOSERS.register('gp_regressor', 'lib.choosers.gp_regressor:next')
 
 DEFAULT_CHOOSER = 'gp_regressor'
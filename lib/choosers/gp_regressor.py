@@ -20,43 +20,197 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
+import copy
+import time
+
 import numpy as np
 import numpy.random as npr
-import pandas as pd
+import scipy.linalg
 import scipy.stats as sps
 
-from sklearn.gaussian_process import GaussianProcess
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, ConstantKernel
+
+from lib import acquisition, instrumentation
+from lib.model_cache import MODEL_CACHE
+
+BATCH_SHORTLIST = 10
+NUGGET = 1e-6
+# the kernel hyperparameters are optimized starting from the previous iteration's, and
+# from this many random starts as well every GP_RESTART_EVERY results or whenever the
+# log likelihood per result drops by more than GP_LIKELIHOOD_TOLERANCE
+GP_RESTARTS = 10
+GP_RESTART_EVERY = 20
+GP_LIKELIHOOD_TOLERANCE = 0.25
+
+
+class IncrementalGaussianProcessRegressor(GaussianProcessRegressor):
+    """A Gaussian process that can absorb new observations without a refit.
+
+    The targets are standardized on every fit and update. The Cholesky factor of the kernel
+    matrix does not depend on the targets, so an update only appends rows to it, keeping
+    the kernel hyperparameters of the last fit.
+    """
+
+    def __init__(self, kernel=None, nugget=NUGGET, optimizer='fmin_l_bfgs_b', n_restarts_optimizer=0,
+                 random_state=None):
+        super(IncrementalGaussianProcessRegressor, self).__init__(kernel=kernel,
+                                                                  alpha=nugget,
+                                                                  optimizer=optimizer,
+                                                                  n_restarts_optimizer=n_restarts_optimizer,
+                                                                  random_state=random_state)
+        self.nugget = nugget
+
+    def fit(self, X, y):
+        # the design matrix is single precision, the kernel matrix has to be factored in double
+        X = np.asarray(X, dtype=float)
+        if self.kernel is None:
+            self.kernel = _default_kernel(X.shape[1])
+        self.y_raw_ = np.asarray(y, dtype=float)
+        self.y_mean_, self.y_std_ = _standardization(self.y_raw_)
+        return super(IncrementalGaussianProcessRegressor, self).fit(X, (self.y_raw_ - self.y_mean_) / self.y_std_)
 
+    def update(self, X, y):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        # [[L, 0], [L21, L22]] is the Cholesky factor of [[K, K12], [K12', K22]]
+        L21 = scipy.linalg.solve_triangular(self.L_, self.kernel_(self.X_train_, X), lower=True).T
+        K22 = self.kernel_(X) + self.nugget * np.eye(X.shape[0])
+        L22 = np.linalg.cholesky(K22 - L21.dot(L21.T))
+        self.L_ = np.vstack([np.hstack([self.L_, np.zeros((self.L_.shape[0], X.shape[0]))]),
+                             np.hstack([L21, L22])])
+        self.X_train_ = np.vstack([self.X_train_, X])
+        self.y_raw_ = np.concatenate([self.y_raw_, np.asarray(y, dtype=float)])
+        self.y_mean_, self.y_std_ = _standardization(self.y_raw_)
+        self.y_train_ = (self.y_raw_ - self.y_mean_) / self.y_std_
+        self.alpha_ = scipy.linalg.cho_solve((self.L_, True), self.y_train_)
+        self._K_inv = None
+        return self
 
-def next(grid, candidates, pending, complete, completed_values):
-    gp = GaussianProcess(random_start=10, nugget=1e-6)
-    gp.fit(_encode_categorical_df(complete, grid), completed_values)
+    def predict(self, X):
+        mean, std = super(IncrementalGaussianProcessRegressor, self).predict(X, return_std=True)
+        return mean * self.y_std_ + self.y_mean_, (std * self.y_std_) ** 2
+
+    def log_likelihood(self):
+        """Log marginal likelihood of the training targets, computed from the current factorization."""
+        return (-0.5 * self.y_train_.dot(self.alpha_) - np.log(np.diag(self.L_)).sum()
+                - 0.5 * self.L_.shape[0] * np.log(2 * np.pi))
+
+    @property
+    def nbytes(self):
+        return self.X_train_.nbytes + self.L_.nbytes + 3 * self.y_raw_.nbytes
+
+
+def next(grid, pending, complete, completed_values, n=1, max_candidates=None, batch=False, cache_key=None,
+         sampling='random', state=None):
+    encode = grid.encoder.transform
+    with instrumentation.phase('fit'):
+        gp = _fit(encode, complete, completed_values, cache_key, state)
     if pending.shape[0]:
-        # Generate fantasies for pending
-        mean, variance = gp.predict(_encode_categorical_df(pending, grid), eval_MSE=True)
-        pending_value_estimation = pd.Series(mean + np.sqrt(variance) * npr.randn(mean.shape[0]))
-        gp.fit(_encode_categorical_df(complete.append(pending), grid),
-               completed_values.append(pending_value_estimation))
-
-    # Predict the marginal means and variances at candidates.
-    mean, variance = gp.predict(_encode_categorical_df(candidates, grid), eval_MSE=True)
+        # Generate fantasies for pending, on a copy so the cached model only ever sees real observations
+        with instrumentation.phase('fantasies'):
+            X = encode(pending.index)
+            mean, variance = gp.predict(X)
+            gp = _update(copy.deepcopy(gp), X, mean + np.sqrt(variance) * npr.randn(mean.shape[0]))
+
     best = np.min(completed_values)
+    touched = np.concatenate([pending.index.values, complete.index.values])
+    # a batch is picked from a shortlist of the best candidates, those are the only ones worth rescoring
+    num_best = n * BATCH_SHORTLIST if batch else n
+    # Score the candidates block by block, the grid itself is never materialized
+    with instrumentation.phase('acquisition'):
+        blocks = acquisition.candidate_blocks(grid, touched, max_candidates, sampling,
+                                              around=[completed_values.idxmin()])
+        top_cands, _ = acquisition.top_k(lambda loop_ids: _expected_improvement(best, *gp.predict(encode(loop_ids))),
+                                         blocks, num_best)
+    if not batch:
+        return top_cands.tolist()
+
+    # Kriging believer: pretend that the model's own prediction was observed at every
+    # point picked so far, so that the next pick is drawn away from it
+    if not pending.shape[0]:
+        gp = copy.deepcopy(gp)
+    candidates = encode(top_cands)
+    chosen = []
+    for _ in range(min(n, top_cands.shape[0])):
+        mean, variance = gp.predict(candidates)
+        ei = _expected_improvement(best, mean, variance)
+        ei[chosen] = -np.inf
+        which = int(np.argmax(ei))
+        chosen.append(which)
+        gp = _update(gp, candidates[[which]], mean[[which]])
+    return top_cands[chosen].tolist()
+
 
+def _fit(encode, complete, completed_values, cache_key=None, state=None):
+    """Fit a GP to the completed trials, reusing and extending the cached one when possible.
+
+    `state` carries the kernel hyperparameters over between iterations, the way the model
+    was obtained and how long it took are recorded in it under "last_fit".
+    """
+    state = {} if state is None else state
+    start = time.time()
+    num_complete = complete.shape[0]
+    key = (__name__, cache_key)
+    entry = MODEL_CACHE.lookup(key, complete.index, incremental=True) if cache_key is not None else None
+    gp, method = None, None
+    if entry is not None and len(entry.loop_ids) == num_complete:
+        gp, method = entry.model, 'cached'
+    elif entry is not None:
+        new = ~complete.index.isin(list(entry.loop_ids))
+        gp = _update(copy.deepcopy(entry.model), encode(complete.index[new]), completed_values.values[new])
+        method = 'incremental'
+        if _degraded(gp, state):
+            gp = None
+    restart = num_complete - state.get('restarted_at', 0) >= GP_RESTART_EVERY or 'theta' not in state
+    if gp is None or (restart and method != 'cached'):
+        X, y = encode(complete.index), completed_values.values
+        kernel = _default_kernel(X.shape[1])
+        if 'theta' in state and len(state['theta']) == kernel.theta.shape[0]:
+            kernel = kernel.clone_with_theta(np.array(state['theta']))
+        if not restart:
+            gp, method = IncrementalGaussianProcessRegressor(kernel).fit(X, y), 'warm_start'
+            restart = _degraded(gp, state)
+        if restart:
+            gp = IncrementalGaussianProcessRegressor(kernel, n_restarts_optimizer=GP_RESTARTS).fit(X, y)
+            method = 'restarts'
+            state['restarted_at'] = num_complete
+        state['theta'] = gp.kernel_.theta.tolist()
+        state['log_likelihood'] = gp.log_likelihood() / num_complete
+    state['last_fit'] = {'method': method, 'seconds': time.time() - start}
+    if cache_key is not None and method != 'cached':
+        MODEL_CACHE.put(key, complete.index, gp, gp.nbytes)
+    return gp
+
+
+def _degraded(gp, state):
+    if 'log_likelihood' not in state:
+        return False
+    return gp.log_likelihood() / gp.L_.shape[0] < state['log_likelihood'] - GP_LIKELIHOOD_TOLERANCE
+
+
+def _default_kernel(num_columns):
+    # one length scale per column of the design matrix, which is scaled to [0, 1]
+    return ConstantKernel(1.0, (1e-2, 1e2)) * RBF(length_scale=np.full(num_columns, 0.5),
+                                                 length_scale_bounds=(1e-2, 1e2))
+
+
+def _update(gp, X, y):
+    try:
+        return gp.update(X, y)
+    except np.linalg.LinAlgError:
+        # the appended block lost positive definiteness to rounding, start over with the same kernel
+        return IncrementalGaussianProcessRegressor(gp.kernel_, optimizer=None).fit(np.vstack([gp.X_train_, X]),
+                                                                                   np.concatenate([gp.y_raw_, y]))
+
+
+def _standardization(y):
+    std = np.std(y)
+    return np.mean(y), std if std > 0 else 1.0
+
+
+def _expected_improvement(best, mean, variance):
     func_s = np.sqrt(variance) + 0.0001
     Z = (best - mean) / func_s
     ncdf = sps.norm.cdf(Z)
     npdf = sps.norm.pdf(Z)
-    ei = func_s * (Z * ncdf + npdf)
-
-    best_cand = np.argmax(ei)
-    return (best_cand, grid)
-
-
-def _encode_categorical_df(df, fullgrid):
-    all_columns = [x for x in pd.get_dummies(fullgrid).columns.values.tolist()
-                   if not x.startswith("_loop")]
-    encoded_df = pd.get_dummies(df)
-    for cl in all_columns:
-        if cl not in encoded_df.columns.values:
-            encoded_df[cl] = 0
-    return encoded_df
+    return func_s * (Z * ncdf + npdf)
@@ -20,9 +20,10 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
-import numpy.random as npr
+import numpy as np
 
 
-def next(grid, candidates, pending, complete, completed_values):
-    random_row = int(npr.randint(candidates.shape[0], size=1))
-    return (random_row, grid)
+def next(grid, pending, complete, completed_values, n=1, max_candidates=None, batch=False, cache_key=None,
+         sampling='random', state=None):
+    touched = np.concatenate([pending.index.values, complete.index.values])
+    return grid.sample(n, touched).tolist()
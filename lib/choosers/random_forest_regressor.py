@@ -20,12 +20,25 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
+import copy
+
 import numpy as np
 import numpy.random as npr
-import pandas as pd
 import scipy.stats as sps
 import sklearn.ensemble
-import sklearn.ensemble.forest
+
+try:
+    from sklearn.externals.joblib import Parallel, delayed
+except ImportError:
+    from joblib import Parallel, delayed
+
+from lib import acquisition, instrumentation
+from lib.model_cache import MODEL_CACHE
+
+BATCH_SHORTLIST = 10
+# rough size of a fitted tree node, its split and its value
+NODE_NBYTES = 64
+N_JOBS = -1
 
 
 class RandomForestRegressorWithVariance(sklearn.ensemble.RandomForestRegressor):
@@ -33,33 +46,118 @@ class RandomForestRegressorWithVariance(sklearn.ensemble.RandomForestRegressor):
         # borrowed from
         # https://github.com/JasperSnoek/spearmint/blob/master/spearmint/spearmint/chooser/RandomForestEIChooser.py
         # A very elegant way to demonstrate the power of the framework
-        X = np.atleast_2d(X)
-        all_y_hat = [tree.predict(X) for tree in self.estimators_]
-        y_hat = sum(all_y_hat) / self.n_estimators
-        y_var = np.var(all_y_hat, axis=0, ddof=1)
-        return y_hat, y_var
+        # the trees release the GIL while predicting, so they write their rows of one array side by side
+        X = np.ascontiguousarray(np.atleast_2d(X), dtype=np.float32)
+        all_y_hat = np.empty((len(self.estimators_), X.shape[0]))
+        Parallel(n_jobs=self.n_jobs, backend="threading")(
+            delayed(_predict_tree)(self, i, X, all_y_hat) for i in range(len(self.estimators_)))
+        return all_y_hat.mean(axis=0), all_y_hat.var(axis=0, ddof=1)
 
+    def refit_leaves(self, X, y):
+        """Return a copy of the forest that keeps every tree's splits but re-estimates its leaves from `X`, `y`.
 
-def next(grid, candidates, pending, complete, completed_values):
-    # some sensible defaults
-    rf = RandomForestRegressorWithVariance(n_estimators=50,
-                                           max_depth=None,
-                                           min_samples_split=1,
-                                           max_features="auto",
-                                           n_jobs=1,
-                                           random_state=None)
-    rf.fit(_encode_categorical_df(complete, grid), completed_values)
+        Far cheaper than growing the trees again, good enough for fantasized observations.
+        Leaves that none of `X` falls into keep their values.
+        """
+        X = np.ascontiguousarray(np.atleast_2d(X), dtype=np.float32)
+        y = np.asarray(y, dtype=float)
+        forest = copy.copy(self)
+        forest.leaf_values_ = Parallel(n_jobs=self.n_jobs, backend="threading")(
+            delayed(_leaf_values)(tree, X, y) for tree in self.estimators_)
+        return forest
+
+    @property
+    def nbytes(self):
+        return NODE_NBYTES * sum(tree.tree_.node_count for tree in self.estimators_)
+
+
+def next(grid, pending, complete, completed_values, n=1, max_candidates=None, batch=False, cache_key=None,
+         sampling='random', state=None):
+    encode = grid.encoder.transform
+    with instrumentation.phase('encode'):
+        X = encode(complete.index)
+    y = completed_values.values
+    with instrumentation.phase('fit'):
+        rf = _fit(X, y, complete.index, cache_key)
     if pending.shape[0]:
-        # Generate fantasies for pending
-        mean, variance = rf.predict(_encode_categorical_df(pending, grid))
-        pending_value_estimation = pd.Series(mean + np.sqrt(variance) * npr.randn(mean.shape[0]))
-        rf.fit(_encode_categorical_df(complete.append(pending), grid),
-               completed_values.append(pending_value_estimation))
-
-    # Predict the marginal means and variances at candidates.
-    mean, variance = rf.predict(_encode_categorical_df(candidates, grid))
+        # Generate fantasies for pending, the trees are kept and only their leaves take them in
+        with instrumentation.phase('fantasies'):
+            X_pending = encode(pending.index)
+            mean, variance = rf.predict(X_pending)
+            X = np.vstack([X, X_pending])
+            y = np.concatenate([y, mean + np.sqrt(variance) * npr.randn(mean.shape[0])])
+            rf = rf.refit_leaves(X, y)
+
     best = np.min(completed_values)
+    touched = np.concatenate([pending.index.values, complete.index.values])
+    # a batch is picked from a shortlist of the best candidates, those are the only ones worth rescoring
+    num_best = n * BATCH_SHORTLIST if batch else n
+    # Score the candidates block by block, the grid itself is never materialized
+    with instrumentation.phase('acquisition'):
+        blocks = acquisition.candidate_blocks(grid, touched, max_candidates, sampling,
+                                              around=[completed_values.idxmin()])
+        top_cands, _ = acquisition.top_k(lambda loop_ids: _expected_improvement(best, *rf.predict(encode(loop_ids))),
+                                         blocks, num_best)
+    if not batch:
+        return top_cands.tolist()
 
+    # Kriging believer: pretend that the forest's own prediction was observed at every
+    # point picked so far, so that the next pick is drawn away from it
+    candidates = encode(top_cands)
+    chosen = []
+    for _ in range(min(n, top_cands.shape[0])):
+        mean, variance = rf.predict(candidates)
+        ei = _expected_improvement(best, mean, variance)
+        ei[chosen] = -np.inf
+        which = int(np.argmax(ei))
+        chosen.append(which)
+        X = np.vstack([X, candidates[[which]]])
+        y = np.concatenate([y, mean[[which]]])
+        rf = rf.refit_leaves(X, y)
+    return top_cands[chosen].tolist()
+
+
+def _new_forest():
+    # some sensible defaults
+    return RandomForestRegressorWithVariance(n_estimators=50,
+                                             max_depth=None,
+                                             min_samples_split=2,
+                                             max_features=1.0,
+                                             n_jobs=N_JOBS,
+                                             random_state=None)
+
+
+def _fit(X, y, loop_ids, cache_key=None):
+    """Fit a forest to the completed trials, unless one fit on exactly these trials is cached."""
+    key = (__name__, cache_key)
+    entry = MODEL_CACHE.lookup(key, loop_ids) if cache_key is not None else None
+    if entry is not None:
+        return entry.model
+    rf = _new_forest().fit(X, y)
+    if cache_key is not None:
+        MODEL_CACHE.put(key, loop_ids, rf, rf.nbytes)
+    return rf
+
+
+def _predict_tree(forest, i, X, out):
+    tree = forest.estimators_[i]
+    leaf_values = getattr(forest, 'leaf_values_', None)
+    if leaf_values is None:
+        out[i] = tree.predict(X, check_input=False)
+    else:
+        out[i] = leaf_values[i][tree.apply(X, check_input=False)]
+
+
+def _leaf_values(tree, X, y):
+    leaves = tree.apply(X, check_input=False)
+    counts = np.bincount(leaves, minlength=tree.tree_.node_count)
+    sums = np.bincount(leaves, weights=y, minlength=tree.tree_.node_count)
+    values = tree.tree_.value[:, 0, 0].copy()
+    values[counts > 0] = sums[counts > 0] / counts[counts > 0]
+    return values
+
+
+def _expected_improvement(best, mean, variance):
     # Expected improvement
     # this is the part that I don't fully understand yet
     # will have to read this: http://arxiv.org/pdf/1012.2599.pdf
@@ -67,17 +165,4 @@ def next(grid, candidates, pending, complete, completed_values):
     Z = (best - mean) / func_s
     ncdf = sps.norm.cdf(Z)
     npdf = sps.norm.pdf(Z)
-    ei = func_s * (Z * ncdf + npdf)
-
-    best_cand = np.argmax(ei)
-    return (best_cand, grid)
-
-
-def _encode_categorical_df(df, fullgrid):
-    all_columns = [x for x in pd.get_dummies(fullgrid).columns.values.tolist()
-                   if not x.startswith("_loop")]
-    encoded_df = pd.get_dummies(df)
-    for cl in all_columns:
-        if cl not in encoded_df.columns.values:
-            encoded_df[cl] = 0
-    return encoded_df
+    return func_s * (Z * ncdf + npdf)
@@ -0,0 +1,64 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+DEFAULTS = {'min_step': 1, 'reduction_factor': 3, 'min_trials': 3}
+
+
+def settings(early_stopping):
+    """The settings of a model grid with the defaults filled in, rejects anything but positive integers."""
+    merged = dict(DEFAULTS)
+    for key, value in (early_stopping or {}).items():
+        if key not in DEFAULTS:
+            raise ValueError("Unknown early stopping setting <{}>, use one of {}".format(key, sorted(DEFAULTS)))
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            raise ValueError("The early stopping setting <{}> must be a positive integer".format(key))
+        merged[key] = value
+    if merged['reduction_factor'] < 2:
+        raise ValueError("The early stopping setting <reduction_factor> must be at least 2")
+    return merged
+
+
+def rung(step, min_step, reduction_factor):
+    """The highest rung a trial has reached at `step`, rungs are at min_step * reduction_factor**k.
+
+    Returns None below the first rung.
+    """
+    if step < min_step:
+        return None
+    k, boundary = 0, min_step * reduction_factor
+    while boundary <= step:
+        k, boundary = k + 1, boundary * reduction_factor
+    return k
+
+
+def should_stop(value, values, reduction_factor, min_trials, minimize=False):
+    """Successive halving at one rung: only the top 1 / reduction_factor of the `values` seen there go on.
+
+    `values` include `value` itself. Nothing is stopped until `min_trials` trials reached the rung,
+    and ties go on.
+    """
+    if len(values) < min_trials:
+        return False
+    promoted = max(1, len(values) // reduction_factor)
+    better = sum(1 for x in values if (x < value if minimize else x > value))
+    return better >= promoted
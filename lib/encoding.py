@@ -0,0 +1,62 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import numpy as np
+
+
+class GridEncoder(object):
+    """Encodes points of a LazyGrid as rows of a numeric design matrix.
+
+    Numeric parameters become a single column scaled to [0, 1], every other parameter
+    a block of one-hot columns, in the order of the grid's columns. The block of each
+    value of each parameter is computed once, so encoding a point is a table lookup
+    per parameter rather than a `pd.get_dummies` over a frame.
+    """
+
+    def __init__(self, grid, dtype=np.float32):
+        self.dtype = dtype
+        self.columns = []
+        self._tables = []
+        for name, values in zip(grid.columns, grid._values):
+            if values.dtype.kind in 'biuf':
+                low, high = values.min(), values.max()
+                table = ((values - low) / float(high - low or 1)).reshape(-1, 1)
+                self.columns.append(name)
+            else:
+                table = np.eye(values.shape[0])
+                self.columns.extend('{}_{}'.format(name, x) for x in values)
+            self._tables.append(table.astype(dtype))
+        self._grid = grid
+
+    @property
+    def width(self):
+        return len(self.columns)
+
+    def transform(self, loop_ids):
+        """Return the C-contiguous design matrix rows of `loop_ids`."""
+        loop_ids = np.asarray(loop_ids, dtype=np.int64)
+        X = np.empty((loop_ids.shape[0], self.width), dtype=self.dtype)
+        start = 0
+        for table, digit in zip(self._tables, self._grid.digits(loop_ids)):
+            X[:, start:start + table.shape[1]] = table[digit]
+            start += table.shape[1]
+        return X
@@ -0,0 +1,91 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import io
+import json
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # the binary formats are optional
+    pyarrow = None
+
+FORMATS = ['json', 'ndjson', 'csv', 'arrow', 'parquet']
+BINARY_FORMATS = ['arrow', 'parquet']
+MIMETYPES = {'json': 'application/json',
+             'ndjson': 'application/x-ndjson',
+             'csv': 'text/csv',
+             'arrow': 'application/vnd.apache.arrow.stream',
+             'parquet': 'application/octet-stream'}
+
+
+def serialize(frames, fmt, columns):
+    """Yield a stream of `fmt` encoded chunks, one per frame of `frames`.
+
+    `columns` describes the frames even when there are none, so that empty CSV and
+    Arrow streams still carry a header. Parquet is a single chunk for all frames.
+    """
+    if fmt == 'ndjson':
+        for frame in frames:
+            yield ''.join(json.dumps(x) + '\n' for x in json.loads(frame.to_json(orient='records')))
+    elif fmt == 'csv':
+        header = True
+        for frame in frames:
+            yield frame.to_csv(index=False, header=header)
+            header = False
+        if header:
+            yield pd.DataFrame(columns=columns).to_csv(index=False)
+    elif fmt == 'arrow':
+        for chunk in _arrow_stream(frames, columns):
+            yield chunk
+    elif fmt == 'parquet':
+        frame = pd.concat(list(frames) or [pd.DataFrame(columns=columns)])
+        buf = io.BytesIO()
+        pyarrow.parquet.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False), buf)
+        yield buf.getvalue()
+    else:
+        raise ValueError("Unknown format <{}>".format(fmt))
+
+
+def _arrow_stream(frames, columns):
+    sink, writer = io.BytesIO(), None
+    for frame in frames:
+        batch = pyarrow.RecordBatch.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.RecordBatchStreamWriter(sink, batch.schema)
+        writer.write_batch(batch)
+        yield _drain(sink)
+    if writer is None:
+        schema = pyarrow.Table.from_pandas(pd.DataFrame(columns=columns), preserve_index=False).schema
+        writer = pyarrow.RecordBatchStreamWriter(sink, schema)
+    writer.close()
+    yield _drain(sink)
+
+
+def _drain(buf):
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return data
@@ -0,0 +1,127 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+"""Time requests and the phases they go through.
+
+Every observation goes into a histogram served in the Prometheus text format, and into
+the timings of the request being handled by the current thread, if any.
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(object):
+    """A histogram of durations in seconds, one series per set of labels."""
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += seconds
+            series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((key, dict(x, buckets=list(x['buckets']))) for key, x in self._series.items())
+        for key, x in series:
+            for bound, count in zip(self.buckets, x['buckets']):
+                lines.append('{}_bucket{} {}'.format(self.name, _labels(key + (('le', repr(bound)),)), count))
+            lines.append('{}_bucket{} {}'.format(self.name, _labels(key + (('le', '+Inf'),)), x['count']))
+            lines.append('{}_sum{} {!r}'.format(self.name, _labels(key), x['sum']))
+            lines.append('{}_count{} {}'.format(self.name, _labels(key), x['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(key):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in key) + '}'
+
+
+REQUEST_SECONDS = Histogram('loop_request_seconds', "Time spent handling requests, by route.")
+PHASE_SECONDS = Histogram('loop_phase_seconds', "Time spent in the phases of requests, by route, chooser and phase.")
+HISTOGRAMS = [REQUEST_SECONDS, PHASE_SECONDS]
+
+_local = threading.local()
+
+
+def start(route):
+    """Start timing a request to `route` on this thread."""
+    _local.labels = {'route': route or '', 'chooser': ''}
+    _local.timings = OrderedDict()
+    _local.started = time.time()
+
+
+def label(**labels):
+    """Label the phases of the current request from now on, with the chooser for instance."""
+    if getattr(_local, 'labels', None) is not None:
+        _local.labels.update(labels)
+
+
+def finish():
+    """Stop timing the current request, returns its duration and the time spent in every phase."""
+    seconds = time.time() - _local.started
+    REQUEST_SECONDS.observe(seconds, route=_local.labels['route'])
+    timings = _local.timings
+    _local.labels = _local.timings = None
+    return seconds, timings
+
+
+@contextmanager
+def phase(name):
+    """Time the body of the `with` block as the phase `name` of the current request."""
+    started = time.time()
+    try:
+        yield
+    finally:
+        record(name, time.time() - started)
+
+
+def record(name, seconds):
+    labels = getattr(_local, 'labels', None) or {'route': '', 'chooser': ''}
+    PHASE_SECONDS.observe(seconds, phase=name, **labels)
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def render():
+    return ''.join(x.render() for x in HISTOGRAMS)
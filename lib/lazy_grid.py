@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import math
+import numpy as np
+import pandas as pd
+
+from functools import reduce
+
+from lib.encoding import GridEncoder
+
+
+class LazyGrid(object):
+    """A Cartesian product of parameter values that is never materialized.
+
+    Only the ordered list of parameters and their values (the spec) is kept around.
+    Every point of the grid is addressed by its `_loop_id`, which is decoded into
+    parameter values with mixed-radix arithmetic: the last parameter varies fastest,
+    exactly like the rows of `itertools.product`.
+    """
+    LOOP_COLUMNS = ['_loop_status', '_loop_value', '_loop_duration', '_loop_id']
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.columns = [x.get("name") for x in spec]
+        self.radices = [len(x.get("values")) for x in spec]
+        self.size = reduce(lambda a, b: a * b, self.radices, 1)
+        if self.size >= 2 ** 63:
+            raise TypeError("A grid of {} points is too large to be indexed".format(self.size))
+        strides = [reduce(lambda a, b: a * b, self.radices[i + 1:], 1) for i in range(len(self.radices))]
+        self._strides = np.array(strides, dtype=np.int64)
+        self._values = [_as_array(x.get("values")) for x in spec]
+        self._encoder = None
+
+    @property
+    def shape(self):
+        return (self.size, len(self.columns) + len(self.LOOP_COLUMNS))
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = GridEncoder(self)
+        return self._encoder
+
+    def digits(self, loop_ids):
+        loop_ids = np.asarray(loop_ids, dtype=np.int64)
+        return [(loop_ids // stride) % radix for stride, radix in zip(self._strides, self.radices)]
+
+    def params(self, loop_id):
+        loop_id = int(loop_id)
+        if not 0 <= loop_id < self.size:
+            raise IndexError("No point with id {} in a grid of size {}".format(loop_id, self.size))
+        return {x.get("name"): x.get("values")[(loop_id // int(stride)) % radix]
+                for x, stride, radix in zip(self.spec, self._strides, self.radices)}
+
+    def neighbors(self, loop_id):
+        """Loop ids of the points that differ from `loop_id` in the value of exactly one parameter.
+
+        Numeric parameters only move to the adjacent values, the others to any other value.
+        """
+        loop_id = int(loop_id)
+        neighbors = []
+        for values, stride, radix, digit in zip(self._values, self._strides, self.radices, self.digits([loop_id])):
+            digit = int(digit[0])
+            if values.dtype.kind in 'biuf':
+                others = [x for x in (digit - 1, digit + 1) if 0 <= x < radix]
+            else:
+                others = [x for x in range(radix) if x != digit]
+            neighbors.extend(loop_id + (x - digit) * int(stride) for x in others)
+        return np.array(neighbors, dtype=np.int64)
+
+    def to_frame(self, loop_ids=None):
+        if loop_ids is None:
+            loop_ids = np.arange(self.size, dtype=np.int64)
+        loop_ids = np.asarray(loop_ids, dtype=np.int64)
+        grid = pd.DataFrame(dict(zip(self.columns, [values[digit] for values, digit
+                                                    in zip(self._values, self.digits(loop_ids))])),
+                            index=loop_ids, columns=self.columns)
+        grid['_loop_status'] = "candidate"
+        grid['_loop_value'] = math.nan
+        grid['_loop_duration'] = math.nan
+        grid['_loop_id'] = loop_ids
+        return grid
+
+    def levels_frame(self):
+        """A small frame in which every value of every parameter appears at least once."""
+        num_rows = max(self.radices or [0])
+        return pd.DataFrame(dict((name, values[np.arange(num_rows) % len(values)])
+                                 for name, values in zip(self.columns, self._values)),
+                            columns=self.columns)
+
+    def sample(self, n, exclude=(), random_state=None):
+        """Draw up to `n` distinct loop ids uniformly from the points not in `exclude`."""
+        random_state = random_state or np.random
+        exclude = np.unique(np.asarray(exclude, dtype=np.int64))
+        n = min(n, self.size - exclude.shape[0])
+        if n <= 0:
+            return np.array([], dtype=np.int64)
+        if 2 * (n + exclude.shape[0]) >= self.size:
+            remaining = np.setdiff1d(np.arange(self.size, dtype=np.int64), exclude, assume_unique=True)
+            return random_state.permutation(remaining)[:n]
+        # the grid is mostly untouched, so rejection sampling converges very quickly
+        sampled = np.array([], dtype=np.int64)
+        while sampled.shape[0] < n:
+            draws = random_state.randint(0, self.size, size=2 * n, dtype=np.int64)
+            draws = draws[~_isin(draws, exclude)]
+            sampled = np.concatenate([sampled, draws])
+            _, first = np.unique(sampled, return_index=True)
+            sampled = sampled[np.sort(first)]
+        return sampled[:n]
+
+    def candidate_blocks(self, exclude=(), block_size=10000, max_candidates=None, random_state=None):
+        """Yield arrays of loop ids that are not in `exclude`, at most `block_size` at a time.
+
+        All remaining points are streamed in order, unless there are more than
+        `max_candidates` of them, in which case a uniform sample of that size is used.
+        """
+        exclude = np.unique(np.asarray(exclude, dtype=np.int64))
+        if max_candidates is not None and self.size - exclude.shape[0] > max_candidates:
+            sampled = self.sample(max_candidates, exclude, random_state)
+            for start in range(0, sampled.shape[0], block_size):
+                yield sampled[start:start + block_size]
+            return
+        for start in range(0, self.size, block_size):
+            block = np.arange(start, min(start + block_size, self.size), dtype=np.int64)
+            block = block[~_isin(block, exclude)]
+            if block.shape[0]:
+                yield block
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return '<LazyGrid of {} points over {}>'.format(self.size, self.columns)
+
+
+def _as_array(values):
+    if all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in values):
+        return np.array(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _isin(values, sorted_unique):
+    if not sorted_unique.shape[0]:
+        return np.zeros(values.shape[0], dtype=bool)
+    position = np.minimum(np.searchsorted(sorted_unique, values), sorted_unique.shape[0] - 1)
+    return sorted_unique[position] == values
@@ -25,8 +25,19 @@ import numpy as np
 import pandas as pd
 import itertools as it
 
+from collections import OrderedDict
+from lib.lazy_grid import LazyGrid
+
 
 def make_grid(payload):
+    return _expand_grid(OrderedDict((x.get("name"), x.get("values")) for x in make_spec(payload)))
+
+
+def make_lazy_grid(payload):
+    return LazyGrid(make_spec(payload))
+
+
+def make_spec(payload):
     values = list()
     for variable in payload.get("params"):
         _check_presense(["name", "type"], variable)
@@ -43,8 +54,8 @@ def make_grid(payload):
         elif variable.get("type") == "float":
             _check_inclusion(["min", "max", "num_points"], variable)
             values.append({"name": variable.get("name"),
-                           "values": list(np.linspace(variable.get("min"), variable.get("max"),
-                                          variable.get("num_points"), endpoint=True))})
+                           "values": np.linspace(variable.get("min"), variable.get("max"),
+                                                 variable.get("num_points"), endpoint=True).tolist()})
         elif variable.get("type") == "enum":
             _check_inclusion(["options"], variable)
             values.append({"name": variable.get("name"), "values": variable.get("options")})
@@ -52,7 +63,7 @@ def make_grid(payload):
             error_string = "Variable {} has incorrect type. Must be one of: int, float, enum"
             raise TypeError(error_string.format(variable.get("name")))
 
-    return _expand_grid({x.get("name"): x.get("values") for x in values})
+    return values
 
 
 def _raise_type_error(missing):
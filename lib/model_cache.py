@@ -0,0 +1,94 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import threading
+
+from collections import OrderedDict, namedtuple
+
+CacheEntry = namedtuple('CacheEntry', ['loop_ids', 'model', 'nbytes'])
+
+
+class ModelCache(object):
+    """An in-process LRU cache of fitted surrogate models, capped by their memory footprint.
+
+    Every entry remembers the set of completed trials (`loop_ids`) its model was fit on.
+    An entry fit on exactly the trials asked for is a hit. An entry fit on a subset of them
+    is stale, it is handed out only to models that can absorb the new observations
+    incrementally and is invalidated otherwise.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.incremental_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def lookup(self, key, loop_ids, incremental=False):
+        loop_ids = frozenset(loop_ids)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.loop_ids == loop_ids:
+                self.hits += 1
+            elif entry is not None and incremental and entry.loop_ids <= loop_ids:
+                self.incremental_hits += 1
+            else:
+                self.misses += 1
+                if entry is not None:
+                    self._drop(key)
+                    self.invalidations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, loop_ids, model, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = CacheEntry(frozenset(loop_ids), model, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self._nbytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'incremental_hits': self.incremental_hits,
+                    'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'evictions': self.evictions}
+
+    def _drop(self, key):
+        self._nbytes -= self._entries.pop(key).nbytes
+
+
+MODEL_CACHE = ModelCache()
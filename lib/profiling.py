@@ -0,0 +1,78 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+
+TOP_FUNCTIONS = 60
+TOP_ALLOCATIONS = 30
+# tracemalloc is process wide, profiled calls take turns
+_lock = threading.Lock()
+
+
+def profiled(func, *args, **kwargs):
+    """Call `func` under cProfile and tracemalloc, returns its result and what was found.
+
+    Only the calling thread is profiled, work handed to other threads shows up as time
+    spent waiting for it. Allocations are traced in every thread.
+    """
+    with _lock:
+        profiler = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            # python 3.9 and up
+            tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        started = time.time()
+        profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            seconds = time.time() - started
+            after = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+    growth = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+    allocations = [{'site': str(x.traceback), 'size_diff': x.size_diff, 'size': x.size, 'count': x.count}
+                   for x in sorted(growth, key=lambda x: -abs(x.size_diff))[:TOP_ALLOCATIONS]]
+    return result, {'seconds': seconds,
+                    'peak_bytes': peak_bytes,
+                    'stats': stream.getvalue(),
+                    # what pstats.Stats.dump_stats would write, for snakeviz and friends
+                    'data': marshal.dumps(stats.stats),
+                    'allocations': allocations}
@@ -21,10 +21,12 @@
 
 
 import os
-from flask.ext.script import Manager
-from flask.ext.migrate import Migrate, MigrateCommand
+from datetime import datetime
+from flask_script import Manager
+from flask_migrate import Migrate, MigrateCommand
 
 from app import app, db
+from models import ModelGrid, Trial
 
 
 app.config.from_object(os.getenv('FLASK_CONFIG') or 'config.DevelopmentConfig')
@@ -35,5 +37,17 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def reclaim_expired():
+    """Return pending points whose lease ran out to the candidates, in every model grid."""
+    expired = db.session.query(Trial.model_id).filter(Trial.status == "pending",
+                                                      Trial.lease_expires_at < datetime.utcnow()).distinct()
+    for model_id in [x[0] for x in expired]:
+        modelgrid = db.session.query(ModelGrid).filter_by(id=model_id).first()
+        loop_ids = modelgrid.reclaim_expired()
+        db.session.commit()
+        print("Reclaimed {} points of model grid {}".format(len(loop_ids), model_id))
+
+
 if __name__ == '__main__':
     manager.run()
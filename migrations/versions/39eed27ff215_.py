@@ -0,0 +1,95 @@
+"""split model grids into trials
+
+Revision ID: 39eed27ff215
+Revises: d08c6339dcef
+Create Date: 2026-10-18 10:12:31.204417
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '39eed27ff215'
+down_revision = 'd08c6339dcef'
+
+import io
+import json
+import pandas as pd
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+BATCH_SIZE = 10000
+
+trials = sa.table('trials',
+                  sa.column('model_id', sa.String()),
+                  sa.column('loop_id', sa.BigInteger()),
+                  sa.column('params', postgresql.JSONB()),
+                  sa.column('status', sa.String()),
+                  sa.column('value', sa.Float()),
+                  sa.column('duration', sa.Float()))
+
+model_grids = sa.table('model_grids',
+                       sa.column('id', sa.String()),
+                       sa.column('grid', postgresql.JSONB()))
+
+
+def upgrade():
+    op.create_table('trials',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('model_id', sa.String(), nullable=False),
+    sa.Column('loop_id', sa.BigInteger(), nullable=False),
+    sa.Column('params', postgresql.JSONB(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('value', sa.Float(), nullable=True),
+    sa.Column('duration', sa.Float(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['model_id'], ['model_grids.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_trials_model_id_loop_id', 'trials', ['model_id', 'loop_id'], unique=True)
+    op.create_index('ix_trials_model_id_status', 'trials', ['model_id', 'status'], unique=False)
+
+    connection = op.get_bind()
+    model_ids = [x[0] for x in connection.execute(sa.text("SELECT id FROM model_grids"))]
+    for model_id in model_ids:
+        # load one blob at a time, these can be hundreds of megabytes each
+        blob = connection.execute(sa.text("SELECT grid FROM model_grids WHERE id = :id"),
+                                  {'id': model_id}).scalar()
+        if blob is None:
+            continue
+        grid = pd.read_json(io.StringIO(blob))
+        columns = [x for x in grid.columns.values.tolist() if not x.startswith("_loop")]
+        params = json.loads(grid[columns].to_json(orient='records'))
+        meta = json.loads(grid[['_loop_id', '_loop_status', '_loop_value', '_loop_duration']].to_json(orient='records'))
+        rows = [{'model_id': model_id,
+                 'loop_id': m['_loop_id'],
+                 'params': p,
+                 'status': m['_loop_status'],
+                 'value': m['_loop_value'],
+                 'duration': m['_loop_duration']} for p, m in zip(params, meta)]
+        for start in range(0, len(rows), BATCH_SIZE):
+            op.bulk_insert(trials, rows[start:start + BATCH_SIZE])
+
+    op.drop_column('model_grids', 'grid')
+
+
+def downgrade():
+    op.add_column('model_grids', sa.Column('grid', postgresql.JSONB(), nullable=True))
+
+    connection = op.get_bind()
+    model_ids = [x[0] for x in connection.execute(sa.text("SELECT id FROM model_grids"))]
+    for model_id in model_ids:
+        rows = connection.execute(sa.text("SELECT loop_id, params, status, value, duration FROM trials "
+                                          "WHERE model_id = :id ORDER BY loop_id"),
+                                  {'id': model_id}).fetchall()
+        grid = pd.DataFrame([x[1] for x in rows])
+        grid['_loop_status'] = [x[2] for x in rows]
+        grid['_loop_value'] = pd.Series([x[3] for x in rows], dtype=float)
+        grid['_loop_duration'] = pd.Series([x[4] for x in rows], dtype=float)
+        grid['_loop_id'] = [x[0] for x in rows]
+        connection.execute(model_grids.update().where(model_grids.c.id == model_id).values(grid=grid.to_json()))
+
+    op.drop_index('ix_trials_model_id_status', table_name='trials')
+    op.drop_index('ix_trials_model_id_loop_id', table_name='trials')
+    op.drop_table('trials')
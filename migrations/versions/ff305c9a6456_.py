@@ -0,0 +1,100 @@
+"""keep a parameter spec on model grids and persist only touched trials
+
+Revision ID: ff305c9a6456
+Revises: 39eed27ff215
+Create Date: 2026-10-18 13:40:02.118305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'ff305c9a6456'
+down_revision = '39eed27ff215'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+BATCH_SIZE = 10000
+
+trials = sa.table('trials',
+                  sa.column('model_id', sa.String()),
+                  sa.column('loop_id', sa.BigInteger()),
+                  sa.column('params', postgresql.JSONB()),
+                  sa.column('status', sa.String()))
+
+model_grids = sa.table('model_grids',
+                       sa.column('id', sa.String()),
+                       sa.column('spec', postgresql.JSONB()),
+                       sa.column('grid_size', sa.BigInteger()))
+
+
+def upgrade():
+    op.add_column('model_grids', sa.Column('spec', postgresql.JSONB(), nullable=True))
+    op.add_column('model_grids', sa.Column('grid_size', sa.BigInteger(), nullable=True))
+
+    connection = op.get_bind()
+    model_ids = [x[0] for x in connection.execute(sa.text("SELECT id FROM model_grids"))]
+    for model_id in model_ids:
+        rows = connection.execute(sa.text("SELECT loop_id, params FROM trials "
+                                          "WHERE model_id = :id ORDER BY loop_id"),
+                                  {'id': model_id}).fetchall()
+        if not rows:
+            continue
+        spec = _derive_spec(model_id, rows)
+        connection.execute(model_grids.update().where(model_grids.c.id == model_id)
+                           .values(spec=spec, grid_size=len(rows)))
+        connection.execute(sa.text("DELETE FROM trials WHERE model_id = :id AND status = 'candidate'"),
+                           {'id': model_id})
+
+
+def downgrade():
+    connection = op.get_bind()
+    grids = connection.execute(sa.text("SELECT id, spec, grid_size FROM model_grids")).fetchall()
+    for model_id, spec, grid_size in grids:
+        if spec is None:
+            continue
+        touched = set(x[0] for x in connection.execute(sa.text("SELECT loop_id FROM trials WHERE model_id = :id"),
+                                                        {'id': model_id}))
+        rows = [{'model_id': model_id, 'loop_id': loop_id, 'params': _decode(spec, loop_id), 'status': 'candidate'}
+                for loop_id in range(grid_size) if loop_id not in touched]
+        for start in range(0, len(rows), BATCH_SIZE):
+            op.bulk_insert(trials, rows[start:start + BATCH_SIZE])
+
+    op.drop_column('model_grids', 'grid_size')
+    op.drop_column('model_grids', 'spec')
+
+
+def _derive_spec(model_id, rows):
+    # Grids were built with itertools.product, so the last parameter varies fastest.
+    # The loop_id at which a parameter first changes its value tells us its position.
+    first = rows[0][1]
+    columns = []
+    for name in first:
+        values, seen, stride = [], set(), None
+        for loop_id, params in rows:
+            value = params.get(name)
+            key = _value_key(value)
+            if key not in seen:
+                seen.add(key)
+                values.append(value)
+            if stride is None and value != first.get(name):
+                stride = loop_id
+        columns.append((stride or len(rows), name, values))
+    columns.sort(key=lambda x: -x[0])
+    spec = [{'name': name, 'values': values} for _, name, values in columns]
+    for loop_id, params in rows:
+        if _decode(spec, loop_id) != params:
+            raise RuntimeError("Model grid {} is not a Cartesian product of its parameters".format(model_id))
+    return spec
+
+
+def _decode(spec, loop_id):
+    params = {}
+    for variable in reversed(spec):
+        loop_id, digit = divmod(loop_id, len(variable['values']))
+        params[variable['name']] = variable['values'][digit]
+    return params
+
+
+def _value_key(value):
+    return (type(value).__name__, value)
@@ -20,57 +20,355 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
+import numpy as np
 import pandas as pd
+from collections import OrderedDict
 from datetime import datetime
-from sqlalchemy import DateTime, ForeignKey
+from sqlalchemy import DateTime, ForeignKey, Index, func, or_
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import JSON
 from sqlalchemy.dialects.postgresql import JSONB
 
 from app import db
+from lib.lazy_grid import LazyGrid
+
+# the test suite runs against SQLite, which has no JSONB
+JSONType = JSONB().with_variant(JSON(), 'sqlite')
+# grids are immutable, keeping them around keeps their design matrix encoders around too
+GRID_CACHE_SIZE = 256
+_grids = OrderedDict()
 
 
 class ModelGrid(db.Model):
     __tablename__ = 'model_grids'
 
     id = db.Column(db.String(), primary_key=True, index=True)
-    grid = db.Column(JSONB)
+    spec = db.Column(JSONType)
+    grid_size = db.Column(db.BigInteger)
     name = db.Column(db.String())
     chooser = db.Column(db.String())
+    chooser_state = db.Column(JSONType)  # whatever the chooser carries over between iterations
     minimize = db.Column(db.Boolean)
+    early_stopping = db.Column(JSONType)  # overrides the defaults of lib.early_stopping
     submissions = relationship("Submission", backref="model_grids", order_by="Submission.created_at")
 
+    # summary of the trials, kept up to date in the transactions that change them
+    best_value = db.Column(db.Float)
+    best_loop_id = db.Column(db.BigInteger)
+    num_complete = db.Column(db.Integer, default=0)
+    num_pending = db.Column(db.Integer, default=0)
+    num_stopped = db.Column(db.Integer, default=0)
+    total_duration = db.Column(db.Float, default=0.0)
+    last_submission_at = db.Column(DateTime)
+
     created_at = db.Column(DateTime, default=datetime.utcnow)
     updated_at = db.Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
-    def __init__(self, id, grid, chooser, name=None, minimize=False):
+    def __init__(self, id, spec, chooser, name=None, minimize=False, early_stopping=None):
         self.id = id
         self.name = name
-        self.grid = grid
+        self.spec = spec
+        self.grid_size = LazyGrid(spec).size
         self.minimize = minimize
         self.chooser = chooser
+        self.early_stopping = early_stopping
 
     def get_grid(self):
-        return pd.read_json(self.grid)
+        grid = _grids.pop(self.id, None)
+        if grid is None:
+            grid = LazyGrid(self.spec)
+        _grids[self.id] = grid
+        while len(_grids) > GRID_CACHE_SIZE:
+            _grids.popitem(last=False)
+        return grid
+
+    def get_trials(self, status=None, start=None, stop=None, limit=None):
+        query = db.session.query(Trial.loop_id, Trial.params, Trial.status, Trial.value, Trial.duration)
+        query = query.filter(Trial.model_id == self.id)
+        if status:
+            query = query.filter(Trial.status == status)
+        if start is not None:
+            query = query.filter(Trial.loop_id >= start)
+        if stop is not None:
+            query = query.filter(Trial.loop_id < stop)
+        query = query.order_by(Trial.loop_id)
+        if limit is not None:
+            query = query.limit(limit)
+        return _trials_to_df(query.all(), self.get_grid().columns)
+
+    def iter_grid(self, subset=None, start=0, chunk_size=10000):
+        """Yield the points of the grid from loop id `start` on, in order, as frames of at most `chunk_size` rows.
+
+        Completed and pending points are paged through the trials table. Everything else is
+        generated from the lazy grid one range at a time and overlaid with the trials in it.
+        """
+        if subset in ("complete", "pending", "stopped"):
+            while True:
+                page = self.get_trials(subset, start=start, limit=chunk_size)
+                if not page.shape[0]:
+                    return
+                yield page
+                start = int(page.index[-1]) + 1
+        grid = self.get_grid()
+        while start < grid.size:
+            stop = min(start + chunk_size, grid.size)
+            page = grid.to_frame(np.arange(start, stop, dtype=np.int64))
+            trials = self.get_trials(start=start, stop=stop)
+            if subset == "candidate":
+                page = page.drop(trials.index)
+            else:
+                page.loc[trials.index, LazyGrid.LOOP_COLUMNS] = trials[LazyGrid.LOOP_COLUMNS]
+            if page.shape[0]:
+                yield page
+            start = stop
+
+    def page_trials(self, status, sort=None, descending=False, filters=None, offset=0, limit=None):
+        """One page of the trials with `status`, sorted by `sort` and filtered on parameter values.
+
+        Sorting and filtering happen in the database, `filters` maps parameter names to the
+        values to keep. Returns the page and the number of trials matching the filters.
+        """
+        numeric = {x['name']: all(_is_number(v) for v in x['values']) for x in self.spec}
+        query = db.session.query(Trial.loop_id, Trial.params, Trial.status, Trial.value, Trial.duration)
+        query = query.filter(Trial.model_id == self.id, Trial.status == status)
+        for name, value in (filters or {}).items():
+            if numeric[name]:
+                query = query.filter(Trial.params[name].as_float() == float(value))
+            else:
+                query = query.filter(Trial.params[name].as_string() == str(value))
+        total = query.count()
+        if sort in numeric:
+            key = Trial.params[sort].as_float() if numeric[sort] else Trial.params[sort].as_string()
+        else:
+            key = {'_loop_value': Trial.value, '_loop_duration': Trial.duration}.get(sort, Trial.loop_id)
+        query = query.order_by(key.desc() if descending else key, Trial.loop_id).offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return _trials_to_df(query.all(), self.get_grid().columns), total
+
+    def get_full_grid(self):
+        grid = self.get_grid().to_frame()
+        trials = self.get_trials()
+        grid.loc[trials.index, LazyGrid.LOOP_COLUMNS] = trials[LazyGrid.LOOP_COLUMNS]
+        return grid
+
+    def get_trial(self, loop_id):
+        return db.session.query(Trial).filter_by(model_id=self.id, loop_id=loop_id).first()
+
+    def touched_ids(self):
+        return set(x.loop_id for x in db.session.query(Trial.loop_id).filter(Trial.model_id == self.id))
+
+    def touch(self):
+        self.updated_at = datetime.utcnow()
+
+    @property
+    def num_candidate(self):
+        return self.grid_size - (self.num_complete or 0) - (self.num_pending or 0) - (self.num_stopped or 0)
+
+    def record_pending(self, num_pending):
+        """Count newly claimed points in the summary, as part of the current transaction."""
+        self._update_summary({ModelGrid.num_pending: ModelGrid.num_pending + num_pending})
+
+    def record_stopped(self):
+        """Count a pending point that was stopped early in the summary."""
+        self._update_summary({ModelGrid.num_pending: ModelGrid.num_pending - 1,
+                              ModelGrid.num_stopped: ModelGrid.num_stopped + 1})
+
+    def reclaim_expired(self):
+        """Return the pending points whose lease ran out to the candidates, as part of the current transaction.
+
+        Candidates are not stored, so their trials and intermediate reports are deleted.
+        Returns the loop ids of the points reclaimed.
+        """
+        return self._reclaim(Trial.lease_expires_at < datetime.utcnow())
+
+    def release(self, loop_ids):
+        """Return the pending points in `loop_ids` to the candidates right away, like `reclaim_expired`."""
+        return self._reclaim(Trial.loop_id.in_(loop_ids))
+
+    def _reclaim(self, criterion):
+        query = db.session.query(Trial.loop_id).filter(Trial.model_id == self.id, Trial.status == "pending", criterion)
+        loop_ids = [x[0] for x in query.with_for_update()]
+        if not loop_ids:
+            return loop_ids
+        db.session.query(Trial).filter(Trial.model_id == self.id, Trial.loop_id.in_(loop_ids)) \
+            .delete(synchronize_session=False)
+        db.session.query(IntermediateReport) \
+            .filter(IntermediateReport.model_id == self.id, IntermediateReport.loop_id.in_(loop_ids)) \
+            .delete(synchronize_session=False)
+        self._update_summary({ModelGrid.num_pending: ModelGrid.num_pending - len(loop_ids)})
+        return loop_ids
+
+    def renew_leases(self, loop_ids, lease_expires_at):
+        """Extend the leases of the pending points in `loop_ids`. Returns the ones that are not pending anymore."""
+        query = db.session.query(Trial).filter(Trial.model_id == self.id, Trial.status == "pending",
+                                               Trial.loop_id.in_(loop_ids))
+        held = set(x[0] for x in query.with_entities(Trial.loop_id).with_for_update())
+        query.update({Trial.lease_expires_at: lease_expires_at}, synchronize_session=False)
+        return [x for x in loop_ids if x not in held]
+
+    def record_results(self, results):
+        """Fold `results`, tuples of (loop_id, value, duration, was_pending), into the summary.
+
+        Counts are incremented in SQL so that concurrent reports do not overwrite each other,
+        and the best value is only replaced by a better one.
+        """
+        if not results:
+            return
+        self._update_summary({
+            ModelGrid.num_complete: ModelGrid.num_complete + len(results),
+            ModelGrid.num_pending: ModelGrid.num_pending - sum(1 for x in results if x[3]),
+            ModelGrid.total_duration: ModelGrid.total_duration + sum(x[2] or 0.0 for x in results),
+            ModelGrid.last_submission_at: datetime.utcnow()})
+        pick = min if self.minimize else max
+        loop_id, value = pick(((x[0], x[1]) for x in results), key=lambda x: x[1])
+        better = ModelGrid.best_value > value if self.minimize else ModelGrid.best_value < value
+        db.session.query(ModelGrid).filter(ModelGrid.id == self.id, or_(ModelGrid.best_value.is_(None), better)) \
+            .update({ModelGrid.best_value: value, ModelGrid.best_loop_id: loop_id}, synchronize_session=False)
+
+    def _update_summary(self, values):
+        db.session.query(ModelGrid).filter(ModelGrid.id == self.id).update(values, synchronize_session=False)
+
+    def __repr__(self):
+        return '<model_grid {} using chooser {}>'.format(self.id, self.chooser)
+
+
+class Trial(db.Model):
+    __tablename__ = 'trials'
+    __table_args__ = (
+        Index('ix_trials_model_id_loop_id', 'model_id', 'loop_id', unique=True),
+        Index('ix_trials_model_id_status', 'model_id', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    model_id = db.Column(db.String(), ForeignKey('model_grids.id'), nullable=False)
+    loop_id = db.Column(db.BigInteger(), nullable=False)
+    params = db.Column(JSONType)
+    status = db.Column(db.String(), default="pending")
+    value = db.Column(db.Float())
+    duration = db.Column(db.Float())
+    lease_expires_at = db.Column(DateTime)  # pending points without a heartbeat by then are reclaimed
 
-    def best_value(self):
-        values = [x.value for x in self.submissions]
-        which = min if self.minimize else max
-        try:
-            best = which(values)
-        except:
-            best = None
-        return best
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+    updated_at = db.Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, model_id, loop_id, params, status="pending", lease_expires_at=None):
+        self.model_id = model_id
+        self.loop_id = loop_id
+        self.params = params
+        self.status = status
+        self.lease_expires_at = lease_expires_at
 
     def __repr__(self):
-        return '<model_grid {} of cardinality {}>'.format(self.id, pd.read_json(self.grid).shape)
+        return '<Trial {} for model grid {} with status {}>'.format(self.loop_id, self.model_id, self.status)
+
+
+class Suggestion(db.Model):
+    """A point ranked ahead of time by the background worker, waiting to be handed out."""
+    __tablename__ = 'suggestions'
+    __table_args__ = (
+        Index('ix_suggestions_model_id_rank', 'model_id', 'rank'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    model_id = db.Column(db.String(), ForeignKey('model_grids.id'), nullable=False)
+    loop_id = db.Column(db.BigInteger(), nullable=False)
+    rank = db.Column(db.Integer(), nullable=False)
+    # the queue is stale as soon as more results have come in than it was ranked with
+    num_complete = db.Column(db.Integer(), nullable=False)
+
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+
+    def __init__(self, model_id, loop_id, rank, num_complete):
+        self.model_id = model_id
+        self.loop_id = loop_id
+        self.rank = rank
+        self.num_complete = num_complete
+
+    def __repr__(self):
+        return '<Suggestion {} ranked {} for model grid {}>'.format(self.loop_id, self.rank, self.model_id)
+
+
+class Projection(db.Model):
+    """A 2d projection of a grid for the t-SNE view, computed once in the background."""
+    __tablename__ = 'projections'
+    __table_args__ = (
+        Index('ix_projections_model_id_metric', 'model_id', 'metric', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    model_id = db.Column(db.String(), ForeignKey('model_grids.id'), nullable=False)
+    metric = db.Column(db.String(), nullable=False)
+    status = db.Column(db.String(), default="computing")
+    method = db.Column(db.String())
+    loop_ids = db.Column(JSONType)
+    coordinates = db.Column(JSONType)
+    # a linear projection (PCA) can place points that were not projected up front
+    components = db.Column(JSONType)
+    error = db.Column(db.String())
+
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+    updated_at = db.Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, model_id, metric):
+        self.model_id = model_id
+        self.metric = metric
+        self.status = "computing"
+
+    def __repr__(self):
+        return '<Projection of model grid {} with {} ({})>'.format(self.model_id, self.metric, self.status)
+
+
+class Profile(db.Model):
+    """What one profiled chooser call spent its time and memory on."""
+    __tablename__ = 'profiles'
+    __table_args__ = (
+        Index('ix_profiles_model_id_created_at', 'model_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    model_id = db.Column(db.String(), ForeignKey('model_grids.id'), nullable=False)
+    chooser = db.Column(db.String())
+    num_complete = db.Column(db.Integer)
+    num_pending = db.Column(db.Integer)
+    seconds = db.Column(db.Float)
+    peak_bytes = db.Column(db.BigInteger)
+    stats = db.Column(db.Text)  # the top functions by cumulative time, as printed by pstats
+    allocations = db.Column(JSONType)
+    data = db.Column(db.LargeBinary)  # the raw pstats data
+
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+
+    def __init__(self, model_id, chooser, num_complete, num_pending, report):
+        self.model_id = model_id
+        self.chooser = chooser
+        self.num_complete = num_complete
+        self.num_pending = num_pending
+        self.seconds = report['seconds']
+        self.peak_bytes = report['peak_bytes']
+        self.stats = report['stats']
+        self.allocations = report['allocations']
+        self.data = report['data']
+
+    def to_dict(self):
+        return {'id': self.id, 'chooser': self.chooser, 'num_complete': self.num_complete,
+                'num_pending': self.num_pending, 'seconds': self.seconds, 'peak_bytes': self.peak_bytes,
+                'stats': self.stats, 'allocations': self.allocations, 'created_at': self.created_at.isoformat()}
+
+    def __repr__(self):
+        return '<Profile {} of model grid {}>'.format(self.id, self.model_id)
 
 
 class Submission(db.Model):
+
     __tablename__ = 'submissions'
+    __table_args__ = (
+        Index('ix_submissions_model_id_created_at', 'model_id', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     model_id = db.Column(db.String(), ForeignKey('model_grids.id'), index=True)
-    loop_id = db.Column(db.Integer())
+    loop_id = db.Column(db.BigInteger())
     value = db.Column(db.Float())
 
     created_at = db.Column(DateTime, default=datetime.utcnow)
@@ -81,8 +379,83 @@ class Submission(db.Model):
         self.model_id = model_id
         self.value = value
 
+    @classmethod
+    def recent_values(cls, model_ids, n):
+        """The last `n` submitted values of every model in `model_ids`, oldest first, in a single query."""
+        position = func.row_number().over(partition_by=cls.model_id,
+                                          order_by=(cls.created_at.desc(), cls.id.desc())).label('position')
+        recent = db.session.query(cls.model_id, cls.value, position).filter(cls.model_id.in_(model_ids)).subquery()
+        rows = db.session.query(recent.c.model_id, recent.c.value).filter(recent.c.position <= n) \
+            .order_by(recent.c.model_id, recent.c.position.desc())
+        values = OrderedDict((x, []) for x in model_ids)
+        for model_id, value in rows:
+            values[model_id].append(value)
+        return values
+
     def __repr__(self):
         return '<Submission id: <{}> for model grid {} of value {} for row {}>'.format(self.id,
                                                                                        self.model_id,
                                                                                        self.value,
                                                                                        self.loop_id)
+
+
+class IntermediateReport(db.Model):
+    """A value reported by a pending trial part of the way through, at some step of its training."""
+    __tablename__ = 'intermediate_reports'
+    __table_args__ = (
+        Index('ix_intermediate_reports_model_id_loop_id', 'model_id', 'loop_id'),
+        Index('ix_intermediate_reports_model_id_rung', 'model_id', 'rung'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    model_id = db.Column(db.String(), ForeignKey('model_grids.id'), nullable=False)
+    loop_id = db.Column(db.BigInteger(), nullable=False)
+    step = db.Column(db.Integer(), nullable=False)
+    value = db.Column(db.Float())
+    # the rung this report put the trial on, only the first report past a rung boundary has one
+    rung = db.Column(db.Integer())
+
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+
+    def __init__(self, model_id, loop_id, step, value, rung=None):
+        self.model_id = model_id
+        self.loop_id = loop_id
+        self.step = step
+        self.value = value
+        self.rung = rung
+
+    @classmethod
+    def highest_rung(cls, model_id, loop_id):
+        return db.session.query(func.max(cls.rung)).filter(cls.model_id == model_id, cls.loop_id == loop_id).scalar()
+
+    @classmethod
+    def rung_values(cls, model_id, rung):
+        return [x[0] for x in db.session.query(cls.value).filter(cls.model_id == model_id, cls.rung == rung)]
+
+    @classmethod
+    def curves(cls, model_id, loop_ids=None):
+        """The reported (step, value) pairs of every trial in `loop_ids`, or of all trials, by loop id."""
+        query = db.session.query(cls.loop_id, cls.step, cls.value).filter(cls.model_id == model_id)
+        if loop_ids is not None:
+            query = query.filter(cls.loop_id.in_(loop_ids))
+        curves = OrderedDict()
+        for loop_id, step, value in query.order_by(cls.loop_id, cls.step, cls.id):
+            curves.setdefault(loop_id, []).append((step, value))
+        return curves
+
+    def __repr__(self):
+        return '<IntermediateReport of {} at step {} for model grid {}>'.format(self.loop_id, self.step,
+                                                                               self.model_id)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _trials_to_df(trials, columns):
+    grid = pd.DataFrame([x.params for x in trials], index=[x.loop_id for x in trials], columns=columns)
+    grid['_loop_status'] = [x.status for x in trials]
+    grid['_loop_value'] = pd.Series([x.value for x in trials], index=grid.index, dtype=float)
+    grid['_loop_duration'] = pd.Series([x.duration for x in trials], index=grid.index, dtype=float)
+    grid['_loop_id'] = grid.index
+    return grid
@@ -0,0 +1,131 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import ModelGrid, Projection
+
+# distances t-SNE may embed the encoded points with, each one is stored as a projection of its own
+METRICS = ('euclidean', 'sqeuclidean', 'manhattan', 'cityblock', 'chebyshev', 'minkowski', 'cosine',
+           'correlation', 'braycurtis', 'canberra', 'hamming')
+
+# projecting a grid can take minutes, it gets a thread of its own
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def get_projection(modelgrid, metric):
+    """Return the stored projection of a model grid, starting to compute it if there is none.
+
+    A projection that has been computing for longer than PROJECTION_TIMEOUT seconds was
+    abandoned, say by a restarted worker, and is started over. So is one that failed that
+    long ago, the failure may have been transient.
+    """
+    query = db.session.query(Projection).filter_by(model_id=modelgrid.id, metric=metric)
+    projection = query.first()
+    if projection is None:
+        try:
+            projection = Projection(modelgrid.id, metric)
+            db.session.add(projection)
+            db.session.commit()
+        except IntegrityError:
+            # another worker has just started it
+            db.session.rollback()
+            return query.first()
+    elif projection.status in ("computing", "failed"):
+        timeout = datetime.utcnow() - timedelta(seconds=app.config['PROJECTION_TIMEOUT'])
+        if projection.updated_at > timeout:
+            return projection
+        projection.status = "computing"
+        projection.error = None
+        projection.updated_at = datetime.utcnow()
+        db.session.commit()
+    else:
+        return projection
+    _executor.submit(_compute_in_background, projection.id)
+    return projection
+
+
+def compute_projection(grid, metric):
+    """Project the points of a grid to 2d.
+
+    Small grids are embedded with t-SNE. Larger ones are projected with PCA fit on a
+    sample of at most PROJECTION_MAX_POINTS of their points, the fitted components are
+    returned along with the sample so that any other point can be placed later on.
+    """
+    # sklearn takes seconds to import, only pay for it when a projection is needed
+    from sklearn.decomposition import PCA
+    from sklearn.manifold import TSNE
+
+    if grid.size <= app.config['TSNE_MAX_POINTS']:
+        loop_ids = np.arange(grid.size, dtype=np.int64)
+        model = TSNE(random_state=0, n_iter_without_progress=30, metric=metric,
+                     perplexity=min(30.0, grid.size - 1))
+        coordinates = model.fit_transform(grid.encoder.transform(loop_ids))
+        return {'method': "tsne", 'loop_ids': loop_ids.tolist(), 'coordinates': coordinates.tolist(),
+                'components': None}
+    loop_ids = np.sort(grid.sample(app.config['PROJECTION_MAX_POINTS']))
+    X = grid.encoder.transform(loop_ids)
+    pca = PCA(n_components=min(2, X.shape[1])).fit(X)
+    components = {'mean': pca.mean_.tolist(), 'components': pca.components_.tolist()}
+    return {'method': "pca", 'loop_ids': loop_ids.tolist(), 'coordinates': _place(components, X).tolist(),
+            'components': components}
+
+
+def project_points(projection, grid, loop_ids=()):
+    """Coordinates of the projected points and of `loop_ids` as far as they can be placed.
+
+    Returns the sorted loop ids and a matching array of coordinates.
+    """
+    projected = np.array(projection.loop_ids, dtype=np.int64)
+    coordinates = np.array(projection.coordinates, dtype=float).reshape(-1, 2)
+    extra = np.setdiff1d(np.asarray(loop_ids, dtype=np.int64), projected)
+    if projection.components is not None and extra.shape[0]:
+        projected = np.concatenate([projected, extra])
+        coordinates = np.vstack([coordinates, _place(projection.components, grid.encoder.transform(extra))])
+    order = np.argsort(projected, kind='mergesort')
+    return projected[order], coordinates[order]
+
+
+def _place(components, X):
+    coordinates = (X - np.array(components['mean'])).dot(np.array(components['components']).T)
+    # a grid over a single numeric parameter only has one component
+    return np.hstack([coordinates, np.zeros((X.shape[0], 2 - coordinates.shape[1]))])
+
+
+def _compute_in_background(projection_id):
+    with app.app_context():
+        projection = db.session.query(Projection).get(projection_id)
+        try:
+            grid = db.session.query(ModelGrid).filter_by(id=projection.model_id).first().get_grid()
+            for key, value in compute_projection(grid, projection.metric).items():
+                setattr(projection, key, value)
+            projection.status = "ready"
+        except Exception as err:
+            app.logger.exception("Unable to project model grid {}".format(projection.model_id))
+            projection.status = "failed"
+            projection.error = str(err)
+        db.session.commit()
@@ -0,0 +1,141 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, exists
+
+from app import app, db
+from lib import instrumentation
+from lib.choosers import LIST_OF_CHOOSERS
+from lib.utils import slice_df
+from models import ModelGrid, Suggestion, Trial
+
+# one background thread per process refits models after results come in
+_executor = ThreadPoolExecutor(max_workers=1)
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+# points stopped early are results too, scored by the last value they reported
+RESULT_STATUSES = ["complete", "stopped"]
+
+
+def rank_points(modelgrid, grid, trials, n, batch=False):
+    """Run the chooser of a model grid on its trials.
+
+    Random search stands in for the chooser until there are enough results to model. Points
+    stopped early count as results, scored by the last value they reported.
+    Returns the ranked loop ids, the chooser state to save and where the time went.
+    """
+    started = time.time()
+    _, pending, _ = slice_df(trials)
+    complete = trials.loc[trials._loop_status.isin(RESULT_STATUSES), :]
+    values = complete["_loop_value"] * (-1)**(modelgrid.minimize + 1)
+    acquisition_function = LIST_OF_CHOOSERS[modelgrid.chooser]
+    if not _uses_model(modelgrid, complete.shape[0]):
+        acquisition_function = LIST_OF_CHOOSERS["random"]
+    state = dict(modelgrid.chooser_state or {})
+    ranked = acquisition_function(grid,
+                                  pending[grid.columns],
+                                  complete[grid.columns],
+                                  values,
+                                  n=n,
+                                  max_candidates=app.config['MAX_CANDIDATES'],
+                                  batch=batch,
+                                  cache_key=modelgrid.id,
+                                  sampling=app.config['CANDIDATE_SAMPLING'],
+                                  state=state)
+    timing = {'fit': state.pop('last_fit', None), 'chooser_seconds': time.time() - started}
+    return ranked, state, timing
+
+
+def queued_points(modelgrid, num_complete):
+    """Loop ids queued for a model grid that nobody has taken yet, best first.
+
+    A queue ranked before the latest results came in, or too long ago, is ignored.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['SUGGESTION_MAX_AGE'])
+    taken = exists().where(and_(Trial.model_id == Suggestion.model_id, Trial.loop_id == Suggestion.loop_id))
+    query = db.session.query(Suggestion.loop_id).filter(Suggestion.model_id == modelgrid.id,
+                                                        Suggestion.num_complete == num_complete,
+                                                        Suggestion.created_at >= cutoff,
+                                                        ~taken)
+    return [x[0] for x in query.order_by(Suggestion.rank).limit(app.config['CLAIM_CANDIDATES'])]
+
+
+def schedule_refresh(modelgrid):
+    """Have the background thread rank the next points of a model grid, unless it already is about to."""
+    if not app.config['PRECOMPUTE_SUGGESTIONS'] or modelgrid.chooser == "random":
+        return
+    with _scheduled_lock:
+        if modelgrid.id in _scheduled:
+            return
+        _scheduled.add(modelgrid.id)
+    _executor.submit(_refresh_in_background, modelgrid.id)
+
+
+def refresh_suggestions(model_id):
+    """Replace the queue of a model grid with freshly ranked points.
+
+    The queue is picked like a batch, so that workers taking consecutive points from it
+    do not all try the same neighbourhood.
+    """
+    modelgrid = db.session.query(ModelGrid).filter_by(id=model_id).first()
+    instrumentation.label(chooser=modelgrid.chooser)
+    grid = modelgrid.get_grid()
+    modelgrid.reclaim_expired()
+    db.session.commit()
+    trials = modelgrid.get_trials()
+    num_complete = num_results(trials)
+    if not _uses_model(modelgrid, num_complete) or grid.size == trials.shape[0]:
+        return
+    ranked, state, _ = rank_points(modelgrid, grid, trials, app.config['SUGGESTION_QUEUE_SIZE'], batch=True)
+    db.session.query(Suggestion).filter_by(model_id=model_id).delete()
+    db.session.add_all([Suggestion(model_id, int(x), rank, num_complete) for rank, x in enumerate(ranked)])
+    if state != modelgrid.chooser_state:
+        modelgrid.chooser_state = state
+    db.session.commit()
+
+
+def _refresh_in_background(model_id):
+    # results reported from now on need another refresh
+    with _scheduled_lock:
+        _scheduled.discard(model_id)
+    with app.app_context():
+        instrumentation.start('refresh_suggestions')
+        try:
+            refresh_suggestions(model_id)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Unable to precompute suggestions for model grid {}".format(model_id))
+        instrumentation.finish()
+
+
+def num_results(trials):
+    """How many results the chooser learns from, the queue is stale once there are more."""
+    return int(trials["_loop_status"].isin(RESULT_STATUSES).sum())
+
+
+def _uses_model(modelgrid, num_complete):
+    return modelgrid.chooser != "random" and num_complete >= (app.config['RANDOM_SEARCH_THRESHOLD'] or 2)
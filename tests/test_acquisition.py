@@ -0,0 +1,57 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import unittest
+import numpy as np
+
+from lib import acquisition
+from lib.make_grid import make_lazy_grid
+
+
+class AcquisitionTestCase(unittest.TestCase):
+    """Test scoring candidates in blocks and sampling them on large grids
+    """
+    def setUp(self):
+        self.grid = make_lazy_grid({'params': [{'max': 99, 'name': 'x', 'min': 0, 'type': 'int'},
+                                               {'options': ['foo', 'bar', 'baz'], 'name': 'y', 'type': 'enum'},
+                                               {'max': 99, 'name': 'z', 'min': 0, 'type': 'int'}]})
+
+    def tearDown(self):
+        acquisition.configure(1)
+
+    def test_top_k(self):
+        acquisition.configure(4)
+        blocks = acquisition.candidate_blocks(self.grid, exclude=[7], block_size=1000)
+        top, scores = acquisition.top_k(lambda loop_ids: -np.abs(loop_ids - 10.0), blocks, 3)
+        self.assertEqual(top.tolist(), [10, 9, 11])
+        self.assertEqual(scores.tolist(), [0, -1, -1])
+
+    def test_subsample(self):
+        for sampling in acquisition.SAMPLINGS:
+            blocks = acquisition.candidate_blocks(self.grid, exclude=[0, 1], max_candidates=500,
+                                                  sampling=sampling, around=[0], block_size=100)
+            sample = np.concatenate(list(blocks))
+            self.assertEqual(len(set(sample)), sample.shape[0])
+            self.assertFalse(set(sample) & set([0, 1]))
+            # neighbors of the best point come first, 1 is a neighbor too but it was excluded
+            self.assertEqual(sample[:3].tolist(), [100, 200, 300])
+            self.assertIn(sample.shape[0], range(500, 504))
@@ -0,0 +1,48 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import unittest
+
+from benchmarks.cases import grid_payload
+from benchmarks.run import compare
+from lib.make_grid import make_lazy_grid
+
+
+class BenchmarksTestCase(unittest.TestCase):
+    """Test the benchmark grids and the comparison against a baseline
+    """
+    def test_grid_payload(self):
+        self.assertEqual(make_lazy_grid(grid_payload(1000, 3)).size, 1000)
+        self.assertEqual(make_lazy_grid(grid_payload(1000000, 2)).size, 1000000)
+
+    def test_compare(self):
+        def results(seconds):
+            return {'results': [{'suite': 'http', 'step': 'trials', 'params': {'size': 1000},
+                                 'seconds': seconds, 'peak_rss_bytes': 100, 'payload_bytes': 10}]}
+        self.assertEqual(compare(results(1.1), results(1.0), 0.2), [])
+        regressions = compare(results(1.3), results(1.0), 0.2)
+        self.assertEqual([x['metric'] for x in regressions], ['seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
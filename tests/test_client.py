@@ -0,0 +1,158 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+import requests
+
+from datetime import datetime
+from werkzeug.serving import make_server
+
+os.environ['APP_SETTINGS'] = 'config.TestingConfig'
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loop_test.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'clients', 'python'))
+
+from app import app, db
+from models import ModelGrid, Trial
+from loop_client import AsyncLoopClient, LoopClient, LoopError
+from loop_client.runner import run
+
+PARAMS = [{'max': 10, 'name': 'x', 'min': 8, 'type': 'int'},
+          {'options': ['foo', 'bar'], 'name': 'y', 'type': 'enum'}]
+CRASHED = os.path.join(tempfile.mkdtemp(), 'crashed')
+
+
+def objective(x, y):
+    if x == 9 and y == 'bar' and not os.path.exists(CRASHED):
+        # the first worker to get this point dies
+        open(CRASHED, 'w').close()
+        os._exit(1)
+    return x + (y == 'foo')
+
+
+class LostResponseSession(requests.Session):
+    """Loses the response to the first bulk report, after the server recorded it
+    """
+    lost = False
+
+    def request(self, method, url, **kwargs):
+        response = super(LostResponseSession, self).request(method, url, **kwargs)
+        if '/report_metrics/' in url and not self.lost:
+            self.lost = True
+            response.status_code = 503
+        return response
+
+
+class ClientTestCase(unittest.TestCase):
+    """Test the python client against a live server
+    """
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_prefetch_and_buffered_reports(self):
+        with LoopClient(self.url, flush_interval=60, batch_size=4) as loop:
+            loop.new_model(PARAMS, chooser='random')
+            points = [loop.next() for _ in range(5)]
+            for point in points:
+                loop.report(point['loop_id'], point['params']['x'])
+            loop.flush()
+            loop.report(points[0]['loop_id'], 1.0)
+            with self.assertRaises(LoopError):
+                loop.flush()
+        # five points were handed out, the one prefetched after them was given back
+        self.assertEqual(len(set(x['loop_id'] for x in points)), 5)
+        response = app.test_client().get('/trials/{}?status=pending'.format(loop.experiment_id))
+        self.assertEqual(json.loads(response.data.decode())['total'], 0)
+
+    def test_lost_response_is_not_an_error(self):
+        with LoopClient(self.url, prefetch=False, backoff=0.01, session=LostResponseSession()) as loop:
+            loop.new_model(PARAMS, chooser='random')
+            point = loop.next()
+            loop.report(point['loop_id'], 2.0)
+            loop.flush()
+        response = app.test_client().get('/last_values/{}'.format(loop.experiment_id))
+        self.assertEqual(json.loads(response.data.decode())['values'], [2.0])
+
+    def test_async(self):
+        async def run():
+            async with AsyncLoopClient(self.url, prefetch=False) as loop:
+                await loop.new_model(PARAMS, chooser='random', minimize=True)
+                point = await loop.next()
+                loop.report(point['loop_id'], 0.5)
+                await loop.flush()
+                return loop.experiment_id
+        model_id = asyncio.new_event_loop().run_until_complete(run())
+        response = app.test_client().get('/last_values/{}'.format(model_id))
+        self.assertEqual(json.loads(response.data.decode())['values'], [0.5])
+
+    def test_runner(self):
+        payload = {'params': PARAMS, 'chooser': 'random', 'minimize': True, 'early_stopping': {'min_step': 2}}
+        summary = run(objective, payload, self.url, workers=3)
+        self.assertEqual(db.session.query(ModelGrid).get(summary['experiment_id']).early_stopping, {'min_step': 2})
+        self.assertEqual((summary['evaluated'], summary['failed']), (6, 0))
+        self.assertEqual((summary['best_value'], summary['best_params']), (8.0, {'x': 8, 'y': 'bar'}))
+        self.assertTrue(os.path.exists(CRASHED))
+        summary = run(objective, payload, self.url, workers=2, budget=4)
+        self.assertEqual(summary['evaluated'], 4)
+        # the rest of the grid, the experiment minimizes
+        self.assertTrue(LoopClient(self.url, summary['experiment_id'], prefetch=False).minimizes())
+        summary = run(objective, None, self.url, summary['experiment_id'], workers=2)
+        response = app.test_client().get('/last_values/{}'.format(summary['experiment_id']))
+        self.assertEqual(summary['best_value'], min(json.loads(response.data.decode())['values'][-2:]))
+
+    def test_heartbeats(self):
+        with LoopClient(self.url, prefetch=False, heartbeat_interval=0.05) as loop:
+            loop.new_model(PARAMS, chooser='random')
+            loop_id = loop.next()['loop_id']
+            trials = db.session.query(Trial).filter_by(model_id=loop.experiment_id, loop_id=loop_id)
+            trials.update({Trial.lease_expires_at: datetime.utcnow()})
+            db.session.commit()
+            time.sleep(0.5)
+            self.assertGreater(trials.one().lease_expires_at, datetime.utcnow())
+            loop.release(loop_id)
+
+    def test_unreachable(self):
+        loop = LoopClient('http://127.0.0.1:1', retries=1, backoff=0.01)
+        with self.assertRaises(LoopError):
+            loop.new_model(PARAMS)
+
+
+if __name__ == '__main__':
+    unittest.main()
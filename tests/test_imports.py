@@ -0,0 +1,95 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import unittest
+
+from unittest import mock
+from lib.choosers import ChooserRegistry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# seconds a worker may spend importing the app, the best of a few tries is taken
+IMPORT_BUDGET = 2.0
+HEAVY_MODULES = ['sklearn', 'scipy', 'lib.choosers.gp_regressor', 'lib.choosers.random_forest_regressor']
+
+CODE = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+started = time.time()
+import app
+seconds = time.time() - started
+choosers = list(app.LIST_OF_CHOOSERS)
+print(json.dumps({{'seconds': seconds, 'choosers': choosers, 'heavy': [x for x in {heavy!r} if x in sys.modules]}}))
+"""
+
+
+class ImportTimeTestCase(unittest.TestCase):
+    """Test that workers boot without importing the choosers
+    """
+    def import_app(self):
+        env = dict(os.environ, APP_SETTINGS='config.TestingConfig',
+                   TEST_DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loop_test.db'))
+        # isolated, so that nothing but the app is imported
+        output = subprocess.check_output([sys.executable, '-I', '-c', CODE.format(root=ROOT, heavy=HEAVY_MODULES)],
+                                         env=env, cwd=ROOT)
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+    def test_import_budget(self):
+        runs = [self.import_app() for _ in range(3)]
+        self.assertEqual(runs[0]['heavy'], [])
+        self.assertEqual(runs[0]['choosers'][:3], ['random', 'random_forest_regressor', 'gp_regressor'])
+        self.assertLess(min(x['seconds'] for x in runs), IMPORT_BUDGET)
+
+    def test_registry(self):
+        registry = ChooserRegistry()
+        registry.register('dotted', 'os.path:join')
+        registry.register('callable', len)
+        self.assertEqual(list(registry), ['dotted', 'callable'])
+        self.assertIs(registry['dotted'], os.path.join)
+        self.assertIs(registry['callable'], len)
+
+    def test_plugins_are_discovered_lazily(self):
+        plugin = mock.NonCallableMock()
+        plugin.name = 'plugin'
+        plugin.load.return_value = len
+        built_in = mock.NonCallableMock()
+        built_in.name = 'built_in'
+        discover = mock.Mock(return_value=[plugin, built_in])
+        registry = ChooserRegistry(discover=discover)
+        registry.register('built_in', 'os.path:join')
+        self.assertIn('built_in', registry)
+        self.assertIs(registry['built_in'], os.path.join)
+        discover.assert_not_called()
+        self.assertIs(registry['plugin'], len)
+        self.assertNotIn('missing', registry)
+        self.assertEqual(list(registry), ['built_in', 'plugin'])
+        self.assertEqual(discover.call_count, 1)
+        built_in.load.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,9 +21,10 @@
 
 
 import unittest
+import numpy
 import pandas
 
-from lib.make_grid import make_grid
+from lib.make_grid import make_grid, make_lazy_grid
 
 
 class MakeGridTestCase(unittest.TestCase):
@@ -38,5 +39,45 @@ class MakeGridTestCase(unittest.TestCase):
         self.assertEqual(grid.shape, (24, 7))
 
 
+class LazyGridTestCase(unittest.TestCase):
+    """Test addressing grid points by their id without materializing the grid
+    """
+    payload = {'params': [{'max': 10, 'name': 'x', 'min': 8, 'type': 'int'},
+                          {'options': ['foo', 'bar'], 'name': 'y', 'type': 'enum'},
+                          {'max': 1, 'name': 'f', 'min': 0, 'type': 'float', 'num_points': 4}]}
+
+    def test_matches_materialized_grid(self):
+        grid = make_grid(self.payload)
+        lazy_grid = make_lazy_grid(self.payload)
+        self.assertEqual(lazy_grid.shape, grid.shape)
+        self.assertTrue(lazy_grid.to_frame().equals(grid))
+        self.assertEqual(lazy_grid.params(13), {'x': 9, 'y': 'bar', 'f': 1.0 / 3})
+
+    def test_huge_grid(self):
+        lazy_grid = make_lazy_grid({'params': [{'max': 9, 'name': str(x), 'min': 0, 'type': 'int'}
+                                               for x in range(10)]})
+        self.assertEqual(lazy_grid.size, 10 ** 10)
+        self.assertEqual(lazy_grid.params(1234567890), {str(x): (x + 1) % 10 for x in range(10)})
+        sample = lazy_grid.sample(1000, exclude=[0, 1, 2])
+        self.assertEqual(len(set(sample)), 1000)
+        self.assertFalse(set(sample) & set([0, 1, 2]))
+
+    def test_candidate_blocks(self):
+        lazy_grid = make_lazy_grid(self.payload)
+        blocks = list(lazy_grid.candidate_blocks(exclude=[0, 5], block_size=10))
+        self.assertEqual([len(x) for x in blocks], [8, 10, 4])
+        blocks = list(lazy_grid.candidate_blocks(exclude=[0, 5], block_size=10, max_candidates=7))
+        self.assertEqual(sum(len(x) for x in blocks), 7)
+
+    def test_encoder(self):
+        lazy_grid = make_lazy_grid(self.payload)
+        encoder = lazy_grid.encoder
+        self.assertEqual(encoder.columns, ['x', 'y_foo', 'y_bar', 'f'])
+        X = encoder.transform([0, 13, 23])
+        self.assertEqual(X.dtype, numpy.float32)
+        self.assertTrue(X.flags['C_CONTIGUOUS'])
+        self.assertTrue(numpy.allclose(X, [[0, 1, 0, 0], [0.5, 0, 1, 1.0 / 3], [1, 0, 1, 1]]))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,62 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import unittest
+import numpy as np
+
+from lib.model_cache import ModelCache
+from lib.choosers.gp_regressor import IncrementalGaussianProcessRegressor
+
+
+class ModelCacheTestCase(unittest.TestCase):
+    """Test reusing fitted surrogate models between iterations
+    """
+    def test_lookup(self):
+        cache = ModelCache(max_bytes=100)
+        cache.put('a', [1, 2], 'model a', 60)
+        self.assertEqual(cache.lookup('a', [2, 1]).model, 'model a')
+        self.assertEqual(cache.lookup('a', [1, 2, 3], incremental=True).model, 'model a')
+        self.assertIsNone(cache.lookup('a', [1, 2, 3]))
+        self.assertIsNone(cache.lookup('a', [1, 2]))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['incremental_hits'], stats['misses'], stats['invalidations']),
+                         (1, 1, 2, 1))
+
+    def test_eviction(self):
+        cache = ModelCache(max_bytes=100)
+        cache.put('a', [1], 'model a', 60)
+        cache.put('b', [1], 'model b', 30)
+        cache.lookup('a', [1])
+        cache.put('c', [1], 'model c', 30)
+        self.assertIsNone(cache.lookup('b', [1]))
+        self.assertEqual(cache.lookup('a', [1]).model, 'model a')
+        self.assertEqual(cache.stats()['bytes'], 90)
+
+    def test_incremental_gp(self):
+        random_state = np.random.RandomState(0)
+        X, y = random_state.rand(30, 3), random_state.rand(30)
+        gp = IncrementalGaussianProcessRegressor().fit(X[:20], y[:20]).update(X[20:], y[20:])
+        refit = IncrementalGaussianProcessRegressor(gp.kernel_, optimizer=None).fit(X, y)
+        mean, variance = gp.predict(X[:5] + 0.1)
+        refit_mean, refit_variance = refit.predict(X[:5] + 0.1)
+        self.assertTrue(np.allclose(mean, refit_mean))
+        self.assertTrue(np.allclose(variance, refit_variance))
@@ -0,0 +1,414 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2017 Avant, Kirill Sevastyanenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import os
+import json
+import marshal
+import tempfile
+import unittest
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from unittest import mock
+
+os.environ['APP_SETTINGS'] = 'config.TestingConfig'
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loop_test.db'))
+
+import app as app_module
+from app import app, db
+from models import IntermediateReport, ModelGrid, Projection, Trial
+from projections import compute_projection, get_projection, project_points
+from lib.choosers.random_forest_regressor import RandomForestRegressorWithVariance, _new_forest
+from suggestions import rank_points, refresh_suggestions
+
+
+class ModelGridTestCase(unittest.TestCase):
+    """Create a fresh database with one model grid for every test
+    """
+    payload = {'chooser': 'random',
+               'params': [{'max': 10, 'name': 'x', 'min': 8, 'type': 'int'},
+                          {'options': ['foo', 'bar'], 'name': 'y', 'type': 'enum'},
+                          {'max': 1, 'name': 'f', 'min': 0, 'type': 'float', 'num_points': 4}]}
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        response = app.test_client().post('/new_model', data=json.dumps(self.payload),
+                                          content_type='application/json')
+        self.model_id = json.loads(response.data.decode())['id']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def modelgrid(self):
+        return db.session.query(ModelGrid).filter_by(id=self.model_id).first()
+
+    def report_metric(self, loop_id, value):
+        app.test_client().post('/report_metric/{}'.format(self.model_id), content_type='application/json',
+                               data=json.dumps({'loop_id': loop_id, 'value': value}))
+
+    def report_intermediate(self, loop_id, step, value):
+        response = app.test_client().post('/report_intermediate/{}'.format(self.model_id),
+                                          content_type='application/json',
+                                          data=json.dumps({'loop_id': loop_id, 'step': step, 'value': value}))
+        return json.loads(response.data.decode())
+
+    def new_iteration(self, _, query=''):
+        response = app.test_client().get('/new_iteration/{}{}'.format(self.model_id, query))
+        return json.loads(response.data.decode())
+
+
+class NewIterationTestCase(ModelGridTestCase):
+    """Test handing out grid points to many workers at the same time
+    """
+    def test_concurrent_workers_get_distinct_points(self):
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            responses = list(pool.map(self.new_iteration, range(20)))
+        loop_ids = [x.get('loop_id') for x in responses]
+        self.assertNotIn(None, loop_ids)
+        self.assertEqual(len(set(loop_ids)), 20)
+
+    def test_claim_raises_other_integrity_errors(self):
+        modelgrid = self.modelgrid()
+        error = IntegrityError("INSERT INTO trials", {}, Exception("foreign key violation"))
+        with mock.patch.object(db.session, 'commit', side_effect=error):
+            with self.assertRaises(IntegrityError):
+                app_module._claim(modelgrid, modelgrid.get_grid(), [0, 1])
+
+    def test_concurrent_workers_exhaust_the_grid(self):
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            responses = list(pool.map(self.new_iteration, range(30)))
+        loop_ids = [x['loop_id'] for x in responses if 'loop_id' in x]
+        self.assertEqual(sorted(loop_ids), list(range(24)))
+        exceptions = [x['exception'] for x in responses if 'exception' in x]
+        self.assertEqual(exceptions, ["There are no more candidates left in the grid."] * 6)
+
+    def test_concurrent_batches(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(lambda x: self.new_iteration(x, '?n=5'), range(4)))
+        self.assertEqual([len(x['points']) for x in responses], [5, 5, 5, 5])
+        loop_ids = [point['loop_id'] for x in responses for point in x['points']]
+        self.assertEqual(len(set(loop_ids)), 20)
+        response = self.new_iteration(None, '?n=5')
+        self.assertEqual(len(response['points']), 4)
+
+
+class RandomForestTestCase(ModelGridTestCase):
+    """Test the random forest chooser
+    """
+    def test_predict_matches_the_trees(self):
+        X, y = np.random.rand(30, 3), np.random.rand(30)
+        forest = _new_forest().fit(X, y)
+        mean, variance = forest.predict(X)
+        per_tree = np.array([tree.predict(X.astype(np.float32)) for tree in forest.estimators_])
+        np.testing.assert_allclose(mean, per_tree.mean(axis=0))
+        np.testing.assert_allclose(variance, per_tree.var(axis=0, ddof=1))
+
+    def test_batch_with_pending_points(self):
+        for loop_id, value in [(0, 1.0), (5, 2.0), (10, 3.0), (20, 0.5)]:
+            self.report_metric(loop_id, value)
+        pending = [x['loop_id'] for x in self.new_iteration(0, '?n=2')['points']]
+        modelgrid = self.modelgrid()
+        modelgrid.chooser = 'random_forest_regressor'
+        refit_leaves = RandomForestRegressorWithVariance.refit_leaves
+        with mock.patch.object(RandomForestRegressorWithVariance, 'refit_leaves', autospec=True,
+                               side_effect=refit_leaves) as refit:
+            ranked, _, _ = rank_points(modelgrid, modelgrid.get_grid(), modelgrid.get_trials(), n=3, batch=True)
+        # once for the pending points, then once per pick
+        self.assertEqual(refit.call_count, 4)
+        self.assertEqual(len(set(ranked)), 3)
+        self.assertFalse(set(ranked) & set(pending + [0, 5, 10, 20]))
+
+
+class SuggestionQueueTestCase(ModelGridTestCase):
+    """Test handing out points that were ranked ahead of time
+    """
+    payload = dict(ModelGridTestCase.payload, chooser='gp_regressor')
+
+    def test_points_come_off_the_queue(self):
+        for loop_id, value in [(0, 1.0), (9, 2.0), (17, 3.0)]:
+            self.report_metric(loop_id, value)
+        refresh_suggestions(self.model_id)
+        responses = [self.new_iteration(x) for x in range(3)]
+        self.assertEqual([x['timing']['queued'] for x in responses], [True] * 3)
+        self.assertEqual(len(set(x['loop_id'] for x in responses)), 3)
+        # a new result makes the queue stale
+        self.report_metric(responses[0]['loop_id'], 4.0)
+        self.assertFalse(self.new_iteration(0)['timing']['queued'])
+
+    def test_stopped_points_make_the_queue_stale(self):
+        for loop_id, value in [(0, 1.0), (9, 2.0), (17, 3.0)]:
+            self.report_metric(loop_id, value)
+        points = [x['loop_id'] for x in self.new_iteration(0, '?n=3')['points']]
+        refresh_suggestions(self.model_id)
+        decisions = [self.report_intermediate(x, 1, v)['decision'] for x, v in zip(points, [0.9, 0.8, 0.1])]
+        self.assertEqual(decisions, ['continue', 'continue', 'stop'])
+        self.assertFalse(self.new_iteration(0)['timing']['queued'])
+
+
+class ProjectionTestCase(ModelGridTestCase):
+    """Test projecting grids that are too large for t-SNE
+    """
+    def test_pca_places_points_outside_of_the_sample(self):
+        limits = {key: app.config[key] for key in ('TSNE_MAX_POINTS', 'PROJECTION_MAX_POINTS')}
+        app.config.update(TSNE_MAX_POINTS=10, PROJECTION_MAX_POINTS=12)
+        try:
+            grid = self.modelgrid().get_grid()
+            projection = Projection(self.model_id, 'euclidean')
+            for key, value in compute_projection(grid, 'euclidean').items():
+                setattr(projection, key, value)
+        finally:
+            app.config.update(limits)
+        self.assertEqual((projection.method, len(projection.loop_ids)), ('pca', 12))
+        loop_ids, coordinates = project_points(projection, grid, range(24))
+        self.assertEqual(loop_ids.tolist(), list(range(24)))
+        self.assertEqual(coordinates.shape, (24, 2))
+
+    def test_failed_projections_are_retried(self):
+        projection = Projection(self.model_id, 'euclidean')
+        projection.status, projection.error = "failed", "MemoryError"
+        db.session.add(projection)
+        db.session.commit()
+        with mock.patch('projections._executor') as executor:
+            self.assertEqual(get_projection(self.modelgrid(), 'euclidean').status, "failed")
+            projection.updated_at = datetime.utcnow() - timedelta(seconds=app.config['PROJECTION_TIMEOUT'] + 1)
+            db.session.commit()
+            self.assertEqual(get_projection(self.modelgrid(), 'euclidean').status, "computing")
+        executor.submit.assert_called_once_with(mock.ANY, projection.id)
+
+    def test_unknown_metrics_are_rejected(self):
+        with mock.patch('projections._executor') as executor:
+            response = app.test_client().get('/tsne_data/{}/?metric=nonsense'.format(self.model_id))
+        self.assertIn('Unknown metric <nonsense>', json.loads(response.data.decode())['exception'])
+        self.assertEqual(db.session.query(Projection).count(), 0)
+        executor.submit.assert_not_called()
+
+
+class PartialDependencyTestCase(ModelGridTestCase):
+    """Test aggregating results by the value of every parameter
+    """
+    def test_aggregates(self):
+        for loop_id, value in [(0, 1.0), (1, 2.0), (13, 6.0)]:
+            self.report_metric(loop_id, value)
+        response = app.test_client().get('/partial_dependency_data/{}'.format(self.model_id))
+        data = json.loads(response.data.decode())['data']
+        self.assertEqual([x['value'] for x in data['y']], ['foo', 'bar'])
+        self.assertEqual([(x['count'], x['mean'], x['min'], x['max']) for x in data['y']],
+                         [(2, 1.5, 1.0, 2.0), (1, 6.0, 6.0, 6.0)])
+        self.assertEqual([x['values'] for x in data['x']], [[1.0, 2.0], [6.0]])
+
+
+class GridExportTestCase(ModelGridTestCase):
+    """Test paging through and streaming the grid
+    """
+    def get(self, query):
+        return app.test_client().get('/grid/{}?{}'.format(self.model_id, query))
+
+    def test_pages_cover_the_grid(self):
+        self.report_metric(3, 1.0)
+        loop_ids, after = [], -1
+        while after is not None:
+            body = json.loads(self.get('limit=10&after={}'.format(after)).data.decode())
+            loop_ids += sorted(json.loads(body['grid'])['_loop_id'].values())
+            after = body['next']
+        self.assertEqual(loop_ids, list(range(24)))
+
+    def test_ndjson_columns(self):
+        self.report_metric(3, 1.0)
+        response = self.get('format=ndjson&columns=x,_loop_status&subset=complete')
+        rows = [json.loads(x) for x in response.data.decode().splitlines()]
+        self.assertEqual(rows, [{'x': 8, '_loop_status': 'complete'}])
+        self.assertIn('exception', json.loads(self.get('columns=z').data.decode()))
+
+
+class LastValuesTestCase(ModelGridTestCase):
+    """Test listing the latest values of many models at once
+    """
+    def test_last_values(self):
+        for loop_id, value in enumerate([1.0, 2.0, 3.0]):
+            self.report_metric(loop_id, value)
+        response = app.test_client().get('/last_values?n=2&ids={},unknown'.format(self.model_id))
+        values = json.loads(response.data.decode())['values']
+        self.assertEqual(values, {self.model_id: [2.0, 3.0], 'unknown': []})
+
+
+class SummaryTestCase(ModelGridTestCase):
+    """Test keeping the summary of a model grid up to date
+    """
+    def test_summary(self):
+        loop_id = self.new_iteration(0)['loop_id']
+        self.assertEqual(self.modelgrid().num_pending, 1)
+        app.test_client().post('/report_metrics/{}'.format(self.model_id), content_type='application/json',
+                               data=json.dumps([{'loop_id': loop_id, 'value': 1.0, 'duration': 2},
+                                                {'loop_id': (loop_id + 1) % 24, 'value': 3.0, 'duration': 4}]))
+        modelgrid = self.modelgrid()
+        self.assertEqual((modelgrid.num_complete, modelgrid.num_pending, modelgrid.num_candidate), (2, 0, 22))
+        self.assertEqual((modelgrid.best_value, modelgrid.best_loop_id), (3.0, (loop_id + 1) % 24))
+        self.assertEqual(modelgrid.total_duration, 6.0)
+        self.assertIsNotNone(modelgrid.last_submission_at)
+
+
+class ReportMetricsTestCase(ModelGridTestCase):
+    """Test that one bad metric does not fail a batch
+    """
+    def report_metrics(self, metrics):
+        response = app.test_client().post('/report_metrics/{}'.format(self.model_id),
+                                          content_type='application/json', data=json.dumps(metrics))
+        return json.loads(response.data.decode())['results']
+
+    def test_ids_off_the_grid(self):
+        results = self.report_metrics([{'loop_id': 1, 'value': 1.0}, {'loop_id': 10 ** 30, 'value': 2.0},
+                                       {'loop_id': -1, 'value': 3.0}])
+        self.assertEqual(['status' in x for x in results], [True, False, False])
+
+    def test_concurrent_report_of_the_same_point(self):
+        record_metrics = app_module._record_metrics
+
+        def clashing(modelgrid, metrics):
+            if not clashing.done:
+                # another request records point 2 in the meantime
+                clashing.done = True
+                with db.engine.begin() as connection:
+                    connection.execute(Trial.__table__.insert().values(model_id=self.model_id, loop_id=2, params={},
+                                                                       status="complete", value=5.0))
+            return record_metrics(modelgrid, metrics)
+        clashing.done = False
+        with mock.patch('app._record_metrics', side_effect=clashing):
+            results = self.report_metrics([{'loop_id': 1, 'value': 1.0}, {'loop_id': 2, 'value': 2.0}])
+        self.assertEqual(['status' in x for x in results], [True, False])
+        self.assertEqual(self.modelgrid().get_trial(1).value, 1.0)
+
+
+class TrialsTestCase(ModelGridTestCase):
+    """Test paging through sorted and filtered trials
+    """
+    def get(self, query):
+        response = app.test_client().get('/trials/{}?{}'.format(self.model_id, query))
+        return json.loads(response.data.decode())
+
+    def test_sort_and_filter(self):
+        for loop_id, value in [(0, 1.0), (9, 3.0), (13, 2.0), (20, 4.0)]:
+            self.report_metric(loop_id, value)
+        body = self.get('limit=2')
+        self.assertEqual([x['_loop_id'] for x in body['trials']], [20, 9])
+        self.assertEqual(body['total'], 4)
+        body = self.get('sort=_loop_value&order=asc&y=bar&offset=1')
+        self.assertEqual([x['_loop_id'] for x in body['trials']], [20])
+        self.assertEqual(body['total'], 2)
+        self.assertEqual([x['_loop_id'] for x in self.get('x=9&sort=y')['trials']], [13, 9])
+        self.assertIn('exception', self.get('sort=z'))
+        response = app.test_client().get('/model/{}/table'.format(self.model_id))
+        self.assertEqual(response.status_code, 200)
+
+
+class InstrumentationTestCase(ModelGridTestCase):
+    """Test timing requests and their phases
+    """
+    def test_timings_and_metrics(self):
+        client = app.test_client()
+        body = json.loads(client.get('/new_iteration/{}'.format(self.model_id)).data.decode())
+        self.assertNotIn('timings', body)
+        response = client.get('/new_iteration/{}'.format(self.model_id), headers={'X-Loop-Timings': '1'})
+        timings = json.loads(response.data.decode())['timings']
+        self.assertTrue({'load', 'queue', 'claim', 'total'} <= set(timings))
+        text = client.get('/metrics').data.decode()
+        self.assertIn('loop_request_seconds_count{route="new_point"}', text)
+        self.assertIn('loop_phase_seconds_bucket{chooser="random",phase="claim",route="new_point",le="+Inf"}', text)
+
+
+class ProfileTestCase(ModelGridTestCase):
+    """Test profiling the chooser on demand
+    """
+    def test_profile(self):
+        client = app.test_client()
+        self.assertIn('exception', self.new_iteration(0, '?profile=1'))
+        token, app.config['ADMIN_TOKEN'] = app.config['ADMIN_TOKEN'], 'secret'
+        try:
+            headers = {'X-Loop-Admin-Token': 'secret'}
+            response = client.get('/new_iteration/{}?profile=1'.format(self.model_id), headers=headers)
+            profile_id = json.loads(response.data.decode())['profile_id']
+            response = client.get('/profiles/{}'.format(self.model_id), headers=headers)
+            profile = json.loads(response.data.decode())['profiles'][0]
+            self.assertEqual((profile['id'], profile['num_complete']), (profile_id, 0))
+            self.assertIn('rank_points', profile['stats'])
+            response = client.get('/profiles/{}/{}.prof'.format(self.model_id, profile_id), headers=headers)
+            self.assertIn('rank_points', [x[2] for x in marshal.loads(response.data)])
+            self.assertIn('exception', json.loads(client.get('/profiles/{}'.format(self.model_id)).data.decode()))
+        finally:
+            app.config['ADMIN_TOKEN'] = token
+
+
+class EarlyStoppingTestCase(ModelGridTestCase):
+    """Test stopping pending points with successive halving
+    """
+    def test_successive_halving(self):
+        a, b, c, d = [x['loop_id'] for x in self.new_iteration(0, '?n=4')['points']]
+        self.assertEqual(self.report_intermediate(a, 1, 0.9), {'decision': 'continue', 'rung': 0})
+        self.assertEqual(self.report_intermediate(b, 1, 0.8)['decision'], 'continue')
+        # the third point at the first rung is behind the top third
+        self.assertEqual(self.report_intermediate(c, 1, 0.1)['decision'], 'stop')
+        self.assertEqual(self.report_intermediate(d, 1, 0.95)['decision'], 'continue')
+        self.assertEqual(self.report_intermediate(d, 2, 0.5), {'decision': 'continue', 'rung': None})
+        self.assertIn('exception', self.report_intermediate(c, 2, 0.2))
+        modelgrid = self.modelgrid()
+        self.assertEqual((modelgrid.num_pending, modelgrid.num_stopped, modelgrid.num_candidate), (3, 1, 20))
+        response = app.test_client().get('/trials/{}?status=stopped'.format(self.model_id))
+        trials = json.loads(response.data.decode())['trials']
+        self.assertEqual([(x['_loop_id'], x['_loop_value']) for x in trials], [(c, 0.1)])
+        response = app.test_client().get('/curves/{}?loop_ids={}'.format(self.model_id, d))
+        self.assertEqual(json.loads(response.data.decode())['curves'], {str(d): [[1, 0.95], [2, 0.5]]})
+
+
+class LeaseTestCase(ModelGridTestCase):
+    """Test reclaiming pending points whose workers stopped heartbeating
+    """
+    def heartbeat(self, loop_ids):
+        response = app.test_client().post('/heartbeat/{}'.format(self.model_id), content_type='application/json',
+                                          data=json.dumps({'loop_ids': loop_ids}))
+        return json.loads(response.data.decode())
+
+    def test_expired_points_are_reclaimed(self):
+        response = self.new_iteration(0, '?n=2&lease=60')
+        a, b = [x['loop_id'] for x in response['points']]
+        self.assertIn('lease_expires_at', response)
+        app.test_client().post('/report_intermediate/{}'.format(self.model_id), content_type='application/json',
+                               data=json.dumps({'loop_id': b, 'step': 1, 'value': 0.5}))
+        db.session.query(Trial).filter_by(model_id=self.model_id, loop_id=b) \
+            .update({Trial.lease_expires_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        self.assertEqual(self.modelgrid().reclaim_expired(), [b])
+        db.session.commit()
+        self.assertEqual(self.heartbeat([a, b])['lost'], [b])
+        modelgrid = self.modelgrid()
+        self.assertEqual((modelgrid.num_pending, modelgrid.num_candidate), (1, 23))
+        self.assertEqual(db.session.query(IntermediateReport).filter_by(model_id=self.model_id).count(), 0)
+        self.assertGreater(modelgrid.get_trial(a).lease_expires_at, datetime.utcnow() + timedelta(seconds=600))
+
+
+if __name__ == '__main__':
+    unittest.main()